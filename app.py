@@ -2,7 +2,10 @@ from flask import Flask, render_template, request, jsonify, Response, redirect,
 import pandas as pd
 import numpy as np
 import json
+import random
+import traceback
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import os
 import io
@@ -11,11 +14,13 @@ import logging
 import threading
 import queue
 import secrets
-from functools import wraps
+from functools import wraps, lru_cache
 from werkzeug.security import generate_password_hash
+from flask.json.provider import DefaultJSONProvider
 import requests
 import akshare as ak
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import atexit
 import time
 import uuid
 import hashlib
@@ -27,22 +32,42 @@ logger = logging.getLogger(__name__)
 # 导入您的ETF数据处理函数
 from models.etf_data import (
     get_etf_data, 
+    get_etf_data_bulk,
     calculate_volatility, 
     calculate_grid_spacing, 
-    calculate_grid_range
+    calculate_grid_range,
+    get_etf_params_bundle,
+    invalidate_etf_params_cache
 )
 
 # 导入用户相关模型和身份验证功能
+from models.db_pool import get_conn
 from models.user import User, Portfolio, FavoriteETF, CustomETF, UserSetting, create_user_tables
-from models.auth import login_user, logout_user, get_current_user, check_csrf_token, login_required, get_user_id
+from models.auth import (
+    login_user, logout_user, get_current_user, check_csrf_token, login_required, get_user_id,
+    validate_csrf_token, csrf_failure_response, CSRF_PROTECTED_METHODS
+)
 
 # 导入ETF管理模块
 from models.etf_admin import (
-    get_all_etfs, get_etf_by_symbol, add_etf, update_etf, delete_etf,
-    get_etf_data_count, get_etf_date_range, clear_etf_data
+    iter_all_etfs, get_etf_by_symbol, etf_exists, add_etf, update_etf, delete_etf,
+    delete_etf_by_id, get_etf_data_stats, clear_etf_data
 )
 
+class AppJSONProvider(DefaultJSONProvider):
+    """JSON序列化：直接支持numpy标量和数组，并且不对键排序以减少大结果的序列化开销"""
+    sort_keys = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
+        return DefaultJSONProvider.default(o)
+
 app = Flask(__name__)
+app.json = AppJSONProvider(app)
 app.config['APP_VERSION'] = 'V0.9'
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_for_testing')
 
@@ -68,6 +93,41 @@ if not app.debug:
     app.logger.setLevel(logging.ERROR)
     app.logger.info('Application startup')
 
+# 日志记录通过队列交给后台线程写入，请求线程只负责格式化消息并入队
+class DeferredQueueHandler(QueueHandler):
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # 入队前先把 msg % args 固定下来，避免参数（如请求字典）在写入前被修改；
+        # 异常堆栈转成文本后丢弃 exc_info，队列中的记录不再持有调用帧；文件写入仍由监听线程完成
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_log_target_handlers = list(app.logger.handlers)
+_log_queue_handler = DeferredQueueHandler(queue.Queue(-1))
+app.logger.handlers = [_log_queue_handler]
+log_listener = None
+
+def start_log_listener():
+    """启动日志监听线程；uwsgi等先加载应用再fork的场景下，子进程中需要重新启动"""
+    global log_listener
+    _log_queue_handler.queue = queue.Queue(-1)
+    log_listener = QueueListener(_log_queue_handler.queue, *_log_target_handlers, respect_handler_level=True)
+    log_listener.start()
+
+def stop_log_listener():
+    if log_listener is not None:
+        log_listener.stop()
+
+start_log_listener()
+os.register_at_fork(after_in_child=start_log_listener)
+atexit.register(stop_log_listener)
+
 # 添加异常处理
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -112,6 +172,34 @@ def get_db_connection():
         print(f"数据库连接失败: {str(e)}")
         raise
 
+# 请求级数据库连接：从连接池借用，同一请求内复用，请求结束时归还连接池，调用方不要 close
+def get_request_db():
+    if 'db' not in g:
+        g.db_ctx = get_conn()
+        g.db = g.db_ctx.__enter__()
+    return g.db
+
+@app.teardown_appcontext
+def close_request_db(exception=None):
+    g.pop('db', None)
+    db_ctx = g.pop('db_ctx', None)
+    if db_ctx is not None:
+        db_ctx.__exit__(None, None, None)
+
+# 时间字符串解析
+def fast_parse_iso(s, _now=datetime.now):
+    """解析数据库中的ISO时间字符串，优先走fromisoformat快速路径，失败时返回当前时间"""
+    if not s:
+        return _now()
+    try:
+        return datetime.fromisoformat(s[:-1] + '+00:00' if s[-1] == 'Z' else s)
+    except (ValueError, TypeError):
+        pass
+    try:
+        return datetime.strptime(s[:19], '%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return _now()
+
 # ETF列表
 def get_official_etf_list():
     """获取官方ETF列表，每次都从数据库获取最新的列表"""
@@ -152,8 +240,36 @@ def get_official_etf_list():
         if conn:
             conn.close()
 
-# 初始化ETF列表
-SYMBOLS = get_official_etf_list()
+@lru_cache(maxsize=1)
+def _official_codes_by_bucket(bucket):
+    """按5分钟时间桶缓存官方ETF代码到名称的映射，bucket变化时自动刷新"""
+    return {etf['code']: etf['name'] for etf in get_official_etf_list()}
+
+def get_official_etf_map():
+    """获取官方ETF代码到名称的映射（最多缓存5分钟）"""
+    return _official_codes_by_bucket(int(time.time() // 300))
+
+def invalidate_official_etf_map():
+    """管理员增删改官方ETF后调用，使本进程的官方ETF映射缓存立即失效"""
+    _official_codes_by_bucket.cache_clear()
+
+def get_user_custom_symbols(user_id):
+    """获取用户自定义ETF代码集合，在同一请求内只查询一次数据库"""
+    cache = g.setdefault('_user_custom_symbols', {})
+    if user_id not in cache:
+        rows = get_request_db().execute('SELECT symbol FROM custom_etfs WHERE user_id = ?', (user_id,)).fetchall()
+        cache[user_id] = {row['symbol'] for row in rows}
+    return cache[user_id]
+
+def refresh_symbols():
+    """从数据库刷新全局官方ETF列表及其代码集合"""
+    global SYMBOLS, OFFICIAL_CODES
+    SYMBOLS = get_official_etf_list()
+    OFFICIAL_CODES = frozenset(s['code'] for s in SYMBOLS)
+    return SYMBOLS
+
+# 初始化ETF列表，OFFICIAL_CODES 用于O(1)判断是否为官方ETF
+refresh_symbols()
 # 如果数据库中没有ETF列表，使用默认列表
 if not SYMBOLS:
     logger.warning("数据库中没有官方ETF列表，使用默认列表")
@@ -235,7 +351,6 @@ cache_expiry = {}
 
 def get_cached_etf_data(symbol):
     """获取缓存的ETF数据，如果缓存过期或不存在则重新获取"""
-    import time
     current_time = time.time()
     
     # 缓存有效期为10分钟
@@ -264,17 +379,13 @@ def get_etf_info(symbol):
     try:
         logger.info(f"正在处理ETF数据请求: {symbol}")
         
-        # 导入datetime模块，确保它在整个函数中可用
-        from datetime import datetime, timedelta
-        
         # 获取请求来源页面和上下文
         referer = request.headers.get('Referer', '')
         page_context = request.args.get('context', '')  # 页面上下文参数
         portfolio_id = request.args.get('portfolio_id', '')  # 投资组合ID参数
         
         # 刷新全局ETF列表，确保使用最新的官方ETF列表
-        global SYMBOLS
-        SYMBOLS = get_official_etf_list()
+        refresh_symbols()
         
         # 获取当前用户(如果已登录)
         user = get_current_user()
@@ -286,16 +397,17 @@ def get_etf_info(symbol):
         access_allowed = False
         
         # 检查是否是官方ETF
-        is_official = any(s['code'] == symbol for s in SYMBOLS)
+        is_official = symbol in OFFICIAL_CODES
         
         if is_official:
             # 官方ETF在所有页面都可以访问
             access_allowed = True
-            etf_name = next((s['name'] for s in SYMBOLS if s['code'] == symbol), '')
-            etf_category = next((s.get('category', '未分类') for s in SYMBOLS if s['code'] == symbol), '未分类')
-            etf_correlation = next((s.get('correlation', '未知') for s in SYMBOLS if s['code'] == symbol), '未知')
-            etf_volatility_type = next((s.get('volatility_type', '未知') for s in SYMBOLS if s['code'] == symbol), '未知')
-            etf_weight = next((s.get('weight', 1.0) for s in SYMBOLS if s['code'] == symbol), 1.0)
+            official_etf = next(s for s in SYMBOLS if s['code'] == symbol)
+            etf_name = official_etf['name']
+            etf_category = official_etf.get('category', '未分类')
+            etf_correlation = official_etf.get('correlation', '未知')
+            etf_volatility_type = official_etf.get('volatility_type', '未知')
+            etf_weight = official_etf.get('weight', 1.0)
             is_custom = False
         else:
             # 对于非官方ETF (自定义ETF)，根据上下文和用户权限进行验证
@@ -321,7 +433,7 @@ def get_etf_info(symbol):
                     # 检查用户是否有权限访问该ETF
                     conn = get_db_connection()
                     cursor = conn.cursor()
-                    cursor.execute('SELECT * FROM custom_etfs WHERE symbol = ? AND user_id = ?', (symbol, user_id))
+                    cursor.execute('SELECT name, description FROM custom_etfs WHERE symbol = ? AND user_id = ? LIMIT 1', (symbol, user_id))
                     custom_etf = cursor.fetchone()
                     conn.close()
                     
@@ -342,7 +454,7 @@ def get_etf_info(symbol):
                             # 从custom_etfs表获取ETF信息
                             conn = get_db_connection()
                             cursor = conn.cursor()
-                            cursor.execute('SELECT * FROM custom_etfs WHERE symbol = ? AND user_id = ?', (symbol, user_id))
+                            cursor.execute('SELECT name, description FROM custom_etfs WHERE symbol = ? AND user_id = ? LIMIT 1', (symbol, user_id))
                             custom_etf = cursor.fetchone()
                             conn.close()
                             
@@ -462,14 +574,14 @@ def get_etf_info(symbol):
             current_price = df['close'].iloc[-1]
             
             # 计算波动率
-            volatility_series = calculate_volatility(symbol)
+            volatility_series = calculate_volatility(symbol, df=df)
             volatility = volatility_series.iloc[-1]
             
             # 计算网格间隔
             grid_spacing = volatility / 8
             
             # 计算网格区间
-            grid_range = calculate_grid_range(symbol)
+            grid_range = calculate_grid_range(symbol, df=df)
             upper_limit = grid_range['H_val'].iloc[-1]
             lower_limit = grid_range['L_val'].iloc[-1]
             
@@ -510,61 +622,31 @@ def get_etf_info(symbol):
                 'weight': etf_weight
             }
             
-            # 获取历史数据
+            # 从df中提取最近30天的价格数据；波动率和网格区间与df同一索引，直接按位置对齐
+            recent_df = df.iloc[-30:]
+            count = len(recent_df)
+            prices = recent_df['close'].to_numpy(dtype=np.float64)
+            vols = volatility_series.to_numpy(dtype=np.float64)[-count:]
+            h_vals = grid_range['H_val'].to_numpy(dtype=np.float64)[-count:]
+            l_vals = grid_range['L_val'].to_numpy(dtype=np.float64)[-count:]
+            
+            # 逐日的网格层数、当前层数和仓位，用数组运算代替逐行分支
+            with np.errstate(divide='ignore', invalid='ignore'):
+                levels = 2 * (h_vals - l_vals) / (h_vals + l_vals) / (vols / 8)
+                level = np.where(prices <= l_vals, 0,
+                                 np.where(prices >= h_vals, levels,
+                                          (prices - l_vals) / ((h_vals - l_vals) / levels)))
+                # 将仓位限制在0-1之间（缺失值按满仓处理，与逐行计算时一致）
+                positions = np.clip(np.nan_to_num(1 - level / levels, nan=1.0), 0, 1)
+            
             history_data = {
-                "dates": [],
-                "prices": [],
-                "volatility": [],
-                "grid_spacing": [],
-                "positions": []
+                "dates": recent_df.index.strftime('%Y-%m-%d').tolist(),
+                "prices": prices.tolist(),
+                "volatility": (vols * 100).tolist(),
+                "grid_spacing": (vols * 100 / 8).tolist(),
+                "positions": (positions * 100).tolist()
             }
             
-            # 从df中提取最近30天的价格数据
-            recent_df = df.iloc[-30:].copy() if len(df) >= 30 else df.copy()
-            for idx, row in recent_df.iterrows():
-                date_str = idx.strftime('%Y-%m-%d')
-                price = float(row['close'])
-                
-                # 为日期和价格添加数据
-                history_data["dates"].append(date_str)
-                history_data["prices"].append(price)
-                
-                # 如果波动率数据可用，添加波动率和网格间隔
-                vol_idx = volatility_series.index.get_indexer([idx], method='nearest')[0]
-                if vol_idx >= 0:
-                    vol = float(volatility_series.iloc[vol_idx])
-                    history_data["volatility"].append(float(vol * 100))
-                    history_data["grid_spacing"].append(float(vol * 100 / 8))
-                    
-                    # 计算历史仓位
-                    range_idx = grid_range.index.get_indexer([idx], method='nearest')[0]
-                    if range_idx >= 0:
-                        h_val = grid_range['H_val'].iloc[range_idx]
-                        l_val = grid_range['L_val'].iloc[range_idx]
-                        
-                        # 计算网格层数
-                        range_pct = 2 * (h_val - l_val) / (h_val + l_val)
-                        levels = range_pct / (vol / 8)
-                        
-                        # 计算当前层数
-                        if price <= l_val:
-                            level = 0
-                        elif price >= h_val:
-                            level = levels
-                        else:
-                            level = (price - l_val) / ((h_val - l_val) / levels)
-                            
-                        # 计算仓位
-                        pos = 1 - level / levels
-                        pos = max(0, min(1, pos))
-                        history_data["positions"].append(float(pos * 100))
-                    else:
-                        history_data["positions"].append(float(position * 100))
-                else:
-                    history_data["volatility"].append(float(volatility * 100))
-                    history_data["grid_spacing"].append(float(volatility * 100 / 8))
-                    history_data["positions"].append(float(position * 100))
-            
             result['historical_data'] = history_data
             
             # 保存到数据库
@@ -613,7 +695,6 @@ def get_etf_info(symbol):
 # 保存ETF历史数据到数据库
 def save_historical_data(symbol, data):
     """保存ETF历史数据到数据库"""
-    from datetime import datetime
     conn = None
     try:
         conn = get_db_connection()
@@ -792,7 +873,7 @@ def get_history(symbol):
         access_allowed = False
         
         # 检查是否是官方ETF
-        is_official = any(s['code'] == symbol for s in SYMBOLS)
+        is_official = symbol in OFFICIAL_CODES
         
         if is_official:
             # 官方ETF在所有页面都可以访问
@@ -807,13 +888,7 @@ def get_history(symbol):
                 # Public_backtest页面允许官方ETF和当前用户自己的ETF
                 if user_id:
                     # 检查用户是否有权限访问该ETF
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT * FROM custom_etfs WHERE symbol = ? AND user_id = ?', (symbol, user_id))
-                    custom_etf = cursor.fetchone()
-                    conn.close()
-                    
-                    if custom_etf:
+                    if symbol in get_user_custom_symbols(user_id):
                         access_allowed = True
             elif 'portfolio' in referer or 'portfolio' == page_context:
                 # Portfolio页面根据是否有portfolio_id参数决定
@@ -893,7 +968,6 @@ def get_history(symbol):
 # 如果数据库中没有数据，实时计算历史数据
 def generate_history_data(symbol):
     try:
-        from datetime import datetime
         logger.info(f"正在实时计算{symbol}的历史数据")
         
         # 获取ETF数据
@@ -903,15 +977,15 @@ def generate_history_data(symbol):
         last_30_days = df.iloc[-30:]
         
         # 计算30天的波动率
-        volatility = calculate_volatility(symbol)
+        volatility = calculate_volatility(symbol, df=df)
         volatility_30d = volatility.iloc[-30:]
         
         # 计算30天的网格间隔
-        grid_spacing = calculate_grid_spacing(symbol)
+        grid_spacing = calculate_grid_spacing(symbol, volatility=volatility)
         grid_spacing_30d = grid_spacing.iloc[-30:]
         
         # 计算30天的网格总区间
-        grid_range = calculate_grid_range(symbol)
+        grid_range = calculate_grid_range(symbol, df=df)
         grid_range_30d = grid_range.iloc[-30:]
         
         # 计算30天的历史仓位
@@ -968,7 +1042,6 @@ def generate_history_data(symbol):
     
     except Exception as e:
         logger.error(f"计算历史数据失败: {str(e)}")
-        import traceback
         error_details = traceback.format_exc()
         logger.error(f"错误详情: {error_details}")
         return jsonify({'error': str(e), 'details': error_details}), 500
@@ -1097,7 +1170,6 @@ def dashboard():
             return redirect(url_for('dashboard'))
         
         # 检查数据库中是否有最新数据
-        from datetime import datetime, timedelta
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -1141,10 +1213,10 @@ def dashboard():
             try:
                 df, _ = get_etf_data(symbol)
                 current_price = df['close'].iloc[-1]
-                volatility_series = calculate_volatility(symbol)
+                volatility_series = calculate_volatility(symbol, df=df)
                 volatility = volatility_series.iloc[-1]
                 grid_spacing = volatility / 8
-                grid_range = calculate_grid_range(symbol)
+                grid_range = calculate_grid_range(symbol, df=df)
                 upper_limit = grid_range['H_val'].iloc[-1]
                 lower_limit = grid_range['L_val'].iloc[-1]
                 range_percentage = 2 * (upper_limit - lower_limit) / (upper_limit + lower_limit)
@@ -1181,7 +1253,6 @@ def dashboard():
                 
             except Exception as e:
                 logger.error(f"从远程获取{symbol}数据时出错: {str(e)}")
-                import traceback
                 traceback.print_exc()
                 data_status = '更新失败'
         
@@ -1212,13 +1283,12 @@ def dashboard():
 @app.route('/history')
 def history():
     # 刷新全局ETF列表，确保使用最新的官方ETF列表
-    global SYMBOLS
-    SYMBOLS = get_official_etf_list()
+    refresh_symbols()
     
     symbol = request.args.get('symbol', '510300')  # 默认为沪深300
     
     # 确保选中的ETF是官方ETF
-    is_official = any(s['code'] == symbol for s in SYMBOLS)
+    is_official = symbol in OFFICIAL_CODES
     if not is_official:
         # 如果不是官方ETF，重定向到默认ETF
         flash(f"ETF {symbol} 不是官方支持的ETF", "warning")
@@ -1231,8 +1301,7 @@ def history():
 @app.route('/portfolio')
 def portfolio():
     # 刷新全局ETF列表，确保使用最新的官方ETF列表
-    global SYMBOLS
-    SYMBOLS = get_official_etf_list()
+    refresh_symbols()
     
     # 检查是否有portfolio_id参数
     portfolio_id = request.args.get('portfolio_id')
@@ -1414,10 +1483,6 @@ def validate_etf_data(df, symbol):
 @app.route('/api/generate_history/<symbol>')
 def generate_history(symbol):
     try:
-        import pandas as pd
-        import numpy as np
-        from datetime import datetime, timedelta
-        
         logger.info(f"生成{symbol}的历史数据")
         
         # 获取ETF数据
@@ -1435,13 +1500,14 @@ def generate_history(symbol):
         latest_date = df.index[-1].strftime('%Y-%m-%d')
         
         cursor.execute('''
-        SELECT * FROM etf_data 
+        SELECT 1 FROM etf_data 
         WHERE symbol = ? AND date = ?
+        LIMIT 1
         ''', (symbol, latest_date))
         
-        latest_record = cursor.fetchone()
+        has_latest_record = cursor.fetchone() is not None
         
-        if latest_record:
+        if has_latest_record:
             # 已经有最新数据，直接从数据库获取历史数据
             cursor.execute('''
             SELECT * FROM etf_data 
@@ -1474,13 +1540,13 @@ def generate_history(symbol):
                 return jsonify(history)
         
         # 计算历史波动率
-        volatility = calculate_volatility(symbol)
+        volatility = calculate_volatility(symbol, df=df)
         
         # 计算历史网格间隔
-        grid_spacing = calculate_grid_spacing(symbol)
+        grid_spacing = calculate_grid_spacing(symbol, volatility=volatility)
         
         # 计算历史网格范围
-        grid_range = calculate_grid_range(symbol)
+        grid_range = calculate_grid_range(symbol, df=df)
         
         # 生成历史数据
         history = []
@@ -1547,7 +1613,6 @@ def generate_history(symbol):
     
     except Exception as e:
         logger.error(f"生成历史数据失败: {str(e)}")
-        import traceback
         error_details = traceback.format_exc()
         logger.error(f"错误详情: {error_details}")
         return jsonify({'error': str(e), 'details': error_details}), 500
@@ -1556,9 +1621,6 @@ def generate_history(symbol):
 def mock_history(symbol):
     """生成模拟历史数据，用于测试"""
     try:
-        import random
-        from datetime import datetime, timedelta
-        
         print(f"生成{symbol}的模拟历史数据")
         
         # 生成30天的日期
@@ -1613,7 +1675,6 @@ def mock_history(symbol):
         return jsonify(history)
     
     except Exception as e:
-        import traceback
         error_details = traceback.format_exc()
         print(f"生成模拟历史数据失败: {str(e)}")
         print(f"错误详情: {error_details}")
@@ -1701,7 +1762,6 @@ def run_backtest():
         return jsonify(result)
     except Exception as e:
         logger.error(f"回测过程中出错: {str(e)}")
-        import traceback
         error_details = traceback.format_exc()
         logger.error(f"错误详情: {error_details}")
         return jsonify({'error': f'回测失败: {str(e)}', 'details': error_details}), 500
@@ -1770,8 +1830,8 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
         df_expanded = df.reindex(all_dates.intersection(pd.date_range(start=df.index.min(), end=df.index.max(), freq='B')))
         df_expanded = df_expanded.fillna(method='ffill')
         
-        # 筛选日期范围
-        df = df_expanded[(df_expanded.index >= start_date) & (df_expanded.index <= end_date)]
+        # 筛选日期范围（索引有序，按标签切片走二分查找）
+        df = df_expanded.loc[start_date:end_date]
         
         # 再次检查并移除可能的NaN值 - 特别是开始边界的数据
         df = df.dropna(subset=['close'])
@@ -1812,6 +1872,9 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
         grid_reset_frequency = 30
         days_since_reset = 0
         
+        # 一次性格式化所有交易日日期，循环中按位置取用
+        date_strings = df.index.strftime('%Y-%m-%d').tolist()
+        
         # 获取第一天的价格
         first_day_price = df['close'].iloc[0]
         logger.info(f"第一天价格: {first_day_price}")
@@ -2016,7 +2079,7 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
             
             # 记录交易
             trade = {
-                'date': df.index[0].strftime('%Y-%m-%d'),
+                'date': date_strings[0],
                 'symbol': symbol,
                 'type': '买入',
                 'price': f'{first_day_price:.4f}',
@@ -2031,12 +2094,11 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
             logger.info(f"初始买入: {buy_quantity}股，价格: {first_day_price:.4f}，金额: {cost:.2f}，持仓金额: {position_value:.2f}")
         
         # 记录第一天的资金数据
-        first_day = df.index[0]
         equity = cash + position * first_day_price
         invested = initial_capital - cash
         profit = equity - initial_capital
         
-        dates.append(first_day.strftime('%Y-%m-%d'))
+        dates.append(date_strings[0])
         total_equity.append(equity)
         invested_capital.append(invested)
         profit_values.append(profit)
@@ -2115,7 +2177,7 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
                                 
                                 # 记录交易
                                 trade = {
-                                    'date': current_day.strftime('%Y-%m-%d'),
+                                    'date': date_strings[day_idx],
                                     'symbol': symbol,
                                     'type': '卖出',
                                     'price': f'{current_price:.4f}',
@@ -2162,7 +2224,7 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
                             
                             # 记录交易
                             trade = {
-                                'date': current_day.strftime('%Y-%m-%d'),
+                                'date': date_strings[day_idx],
                                 'symbol': symbol,
                                 'type': '买入',
                                 'price': f'{current_price:.4f}',
@@ -2185,7 +2247,7 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
             invested = initial_capital - cash
             profit = equity - initial_capital
             
-            dates.append(current_day.strftime('%Y-%m-%d'))
+            dates.append(date_strings[day_idx])
             total_equity.append(equity)
             invested_capital.append(invested)
             profit_values.append(profit)
@@ -2200,15 +2262,12 @@ def backtest_single_etf(symbol, initial_capital, start_date, end_date, grid_leve
             last_invested = invested_capital[-1]
             last_profit = profit_values[-1]
             
-            # 从最后一个数据日期到回测结束日期，按天生成数据点
-            current_date = df.index[-1] + timedelta(days=1)
-            while current_date <= end_date:
-                if current_date.weekday() < 5:  # 只处理工作日（周一到周五）
-                    dates.append(current_date.strftime('%Y-%m-%d'))
-                    total_equity.append(last_equity)
-                    invested_capital.append(last_invested)
-                    profit_values.append(last_profit)
-                current_date += timedelta(days=1)
+            # 从最后一个数据日期到回测结束日期，按工作日（周一到周五）生成数据点
+            extra_dates = pd.bdate_range(start=df.index[-1] + timedelta(days=1), end=end_date).strftime('%Y-%m-%d').tolist()
+            dates.extend(extra_dates)
+            total_equity.extend([last_equity] * len(extra_dates))
+            invested_capital.extend([last_invested] * len(extra_dates))
+            profit_values.extend([last_profit] * len(extra_dates))
         
         # 回测结束前检查是否有未平仓的持仓，尝试在最后一天进行平仓以实现利润
         if position > 0:
@@ -2512,19 +2571,24 @@ def calculate_grid_params():
         grid_range_upper_sum = 0
         grid_range_lower_sum = 0
         
+        # 每个ETF只获取一次数据，多个ETF并发获取
+        etf_frames = get_etf_data_bulk(symbols)
+        
         for symbol in symbols:
+            df = etf_frames[symbol]
+            
             # 计算波动率
-            volatility = calculate_volatility(symbol)
+            volatility = calculate_volatility(symbol, df=df)
             latest_vol = volatility.iloc[-1] if not volatility.empty else 0.2
             volatility_sum += latest_vol
             
             # 计算网格间隔
-            grid_spacing = calculate_grid_spacing(symbol)
+            grid_spacing = calculate_grid_spacing(symbol, volatility=volatility)
             latest_spacing = grid_spacing.iloc[-1] if not grid_spacing.empty else latest_vol / 8
             grid_spacing_sum += latest_spacing
             
             # 计算网格总区间
-            grid_range = calculate_grid_range(symbol)
+            grid_range = calculate_grid_range(symbol, df=df)
             latest_range = grid_range.iloc[-1] if not grid_range.empty else None
             
             if latest_range is not None:
@@ -2560,7 +2624,6 @@ def calculate_grid_params():
         })
     except Exception as e:
         print(f"计算网格参数时出错: {str(e)}")
-        import traceback
         traceback.print_exc()
         return jsonify({'error': f'计算失败: {str(e)}'}), 500
 
@@ -3177,6 +3240,21 @@ def delete_portfolio():
     finally:
         conn.close()
 
+# 判断用户是否为管理员，兼容不同的用户对象类型
+def is_admin_user(user):
+    if not user:
+        return False
+    # 先尝试作为属性访问
+    if hasattr(user, 'is_admin'):
+        return bool(user.is_admin)
+    # 如果是字典类型
+    if isinstance(user, dict) and 'is_admin' in user:
+        return bool(user['is_admin'])
+    # 如果是sqlite Row对象
+    if hasattr(user, 'keys') and 'is_admin' in user.keys():
+        return bool(user['is_admin'])
+    return False
+
 # 管理员权限验证装饰器
 def admin_required(f):
     @wraps(f)
@@ -3191,25 +3269,31 @@ def admin_required(f):
             print("未获取到当前用户")
         
         # 检查用户是否存在且是否为管理员
-        is_admin = False
-        if user:
-            # 先尝试作为属性访问
-            if hasattr(user, 'is_admin'):
-                is_admin = bool(user.is_admin)
-            # 如果是字典类型
-            elif isinstance(user, dict) and 'is_admin' in user:
-                is_admin = bool(user['is_admin'])
-            # 如果是sqlite Row对象
-            elif hasattr(user, 'keys') and 'is_admin' in user.keys():
-                is_admin = bool(user['is_admin'])
-        
-        if not user or not is_admin:
+        if not is_admin_user(user):
             flash('您没有管理员权限！', 'error')
             return redirect(url_for('login'))
             
         return f(*args, **kwargs)
     return decorated_function
 
+# 管理员API装饰器：在一层包装内依次完成登录、管理员权限和CSRF校验
+# 等价于 @login_required + @admin_required + @check_csrf_token
+def admin_api(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return redirect(url_for('login', next=request.url))
+        
+        if not is_admin_user(get_current_user()):
+            flash('您没有管理员权限！', 'error')
+            return redirect(url_for('login'))
+        
+        if request.method in CSRF_PROTECTED_METHODS and not validate_csrf_token():
+            return csrf_failure_response()
+        
+        return f(*args, **kwargs)
+    return decorated_function
+
 # 管理员控制台路由
 @app.route('/admin')
 @login_required
@@ -3268,16 +3352,9 @@ def admin_console():
     # 获取用户数据并转换为可修改的字典列表
     users = [dict(user) for user in cursor.fetchall()]
     
-    # 处理created_at字段
+    # 处理created_at字段，缺失或无法解析时使用当前时间
     for user in users:
-        if 'created_at' in user and user['created_at']:
-            try:
-                user['created_at'] = datetime.fromisoformat(user['created_at'].replace('Z', '+00:00'))
-            except:
-                # 如果转换失败，使用当前时间
-                user['created_at'] = datetime.now()
-        else:
-            user['created_at'] = datetime.now()
+        user['created_at'] = fast_parse_iso(user.get('created_at'))
     
     conn.close()
     
@@ -3308,21 +3385,17 @@ def admin_user_portfolios(user_id):
         
         # 查询用户的投资组合
         cursor.execute('''
-        SELECT p.*, 
-               (SELECT COUNT(*) FROM portfolio_etfs WHERE portfolio_id = p.id) as etf_count 
+        SELECT p.*, COUNT(pe.id) as etf_count 
         FROM portfolios p 
+        LEFT JOIN portfolio_etfs pe ON pe.portfolio_id = p.id
         WHERE p.user_id = ? 
+        GROUP BY p.id
         ORDER BY p.created_at DESC
         ''', (user_id,))
+        # 模板只按键读取字段，sqlite3.Row可直接传递，无需转换为字典
         portfolios = cursor.fetchall()
         
-        # 转换为字典列表
-        portfolio_list = []
-        for portfolio in portfolios:
-            portfolio_dict = dict(portfolio)
-            portfolio_list.append(portfolio_dict)
-        
-        return render_template('admin_user_portfolios.html', user=user, portfolios=portfolio_list)
+        return render_template('admin_user_portfolios.html', user=user, portfolios=portfolios)
     except Exception as e:
         logger.error(f"获取用户投资组合失败: {e}")
         flash(f"获取用户投资组合失败: {e}", "error")
@@ -3368,12 +3441,8 @@ def admin_view_portfolio(portfolio_id):
         portfolio_etfs = cursor.fetchall()
         
         # 转换为字典列表
-        etf_list = []
-        symbols_list = []
-        for etf in portfolio_etfs:
-            etf_dict = dict(etf)
-            etf_list.append(etf_dict)
-            symbols_list.append(etf_dict['symbol'])
+        etf_list = [dict(etf) for etf in portfolio_etfs]
+        symbols_list = [etf['symbol'] for etf in etf_list]
         
         logger.info(f"找到 {len(etf_list)} 个ETF在投资组合中")
         
@@ -3387,14 +3456,12 @@ def admin_view_portfolio(portfolio_id):
         has_etfs = len(etf_list) > 0
         
         # 创建symbols_json
-        import json
         symbols_json = json.dumps(symbols_list)
         
         logger.info(f"准备渲染模板，传递参数: portfolio={portfolio_dict['name']}, is_admin=True, is_custom_portfolio=True, has_etfs={has_etfs}")
         return render_template('portfolio.html', portfolio=portfolio_dict, etfs=etf_list, is_admin=True, is_custom_portfolio=True, has_etfs=has_etfs, symbols_json=symbols_json)
     except Exception as e:
         logger.error(f"获取投资组合详情失败: {e}")
-        import traceback
         logger.error(traceback.format_exc())
         flash(f"获取投资组合详情失败: {e}", "error")
         
@@ -3442,18 +3509,18 @@ def api_get_user(user_id):
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
-    # 查询用户信息
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    # 查询用户信息，只选取可公开的列，不读取密码哈希
+    cursor.execute(
+        "SELECT id, username, email, is_admin, is_active, created_at, last_login FROM users WHERE id = ?",
+        (user_id,)
+    )
     user = cursor.fetchone()
     
     if not user:
         conn.close()
         return jsonify({"error": "用户不存在"}), 404
     
-    # 转换为字典并移除密码
     user_dict = dict(user)
-    if 'password' in user_dict:
-        del user_dict['password']
     
     conn.close()
     
@@ -3461,9 +3528,7 @@ def api_get_user(user_id):
 
 # API端点：创建新用户
 @app.route('/api/admin/users', methods=['POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_create_user():
     data = request.get_json()
     
@@ -3483,7 +3548,7 @@ def api_create_user():
     cursor = conn.cursor()
     
     # 检查用户名或邮箱是否已存在
-    cursor.execute("SELECT * FROM users WHERE username = ? OR email = ?", (username, email))
+    cursor.execute("SELECT 1 FROM users WHERE username = ? OR email = ? LIMIT 1", (username, email))
     existing_user = cursor.fetchone()
     
     if existing_user:
@@ -3510,9 +3575,7 @@ def api_create_user():
 
 # API端点：更新用户信息
 @app.route('/api/admin/users/<int:user_id>', methods=['PUT'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_update_user(user_id):
     data = request.get_json()
     
@@ -3530,7 +3593,7 @@ def api_update_user(user_id):
     cursor = conn.cursor()
     
     # 检查用户是否存在
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    cursor.execute("SELECT 1 FROM users WHERE id = ? LIMIT 1", (user_id,))
     user = cursor.fetchone()
     
     if not user:
@@ -3538,7 +3601,7 @@ def api_update_user(user_id):
         return jsonify({"error": "用户不存在"}), 404
     
     # 检查用户名或邮箱是否与其他用户冲突
-    cursor.execute("SELECT * FROM users WHERE (username = ? OR email = ?) AND id != ?", 
+    cursor.execute("SELECT 1 FROM users WHERE (username = ? OR email = ?) AND id != ? LIMIT 1", 
                  (username, email, user_id))
     existing_user = cursor.fetchone()
     
@@ -3571,16 +3634,14 @@ def api_update_user(user_id):
 
 # API端点：删除用户
 @app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_delete_user(user_id):
     # 连接数据库
     conn = sqlite3.connect('database/etf_history.db')
     cursor = conn.cursor()
     
     # 检查用户是否存在
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    cursor.execute("SELECT 1 FROM users WHERE id = ? LIMIT 1", (user_id,))
     user = cursor.fetchone()
     
     if not user:
@@ -3623,16 +3684,14 @@ def api_delete_user(user_id):
 
 # API端点：管理员删除投资组合
 @app.route('/api/admin/portfolios/<int:portfolio_id>', methods=['DELETE'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_delete_portfolio(portfolio_id):
     # 连接数据库
     conn = sqlite3.connect('database/etf_history.db')
     cursor = conn.cursor()
     
     # 检查投资组合是否存在
-    cursor.execute("SELECT * FROM portfolios WHERE id = ?", (portfolio_id,))
+    cursor.execute("SELECT 1 FROM portfolios WHERE id = ? LIMIT 1", (portfolio_id,))
     portfolio = cursor.fetchone()
     
     if not portfolio:
@@ -3670,40 +3729,26 @@ def admin_etfs():
     search = request.args.get('search', '')
     tab = request.args.get('tab', 'official')  # 默认显示官方ETF
     
-    # 获取所有ETF
-    etfs = get_all_etfs()
+    # 逐行读取ETF，只把官方ETF（is_official=1）转换为字典
+    etfs = [dict(etf) for etf in iter_all_etfs() if etf['is_official'] == 1]
     
     # 获取所有用户自定义ETF
     custom_etfs = CustomETF.get_all_custom_etfs()
     
     # 如果有搜索条件，过滤ETF列表
     if search:
-        etfs = [dict(etf) for etf in etfs if search.lower() in etf['symbol'].lower() or 
+        etfs = [etf for etf in etfs if search.lower() in etf['symbol'].lower() or 
                 (etf['name'] and search.lower() in etf['name'].lower())]
         custom_etfs = [etf for etf in custom_etfs if search.lower() in etf['symbol'].lower() or 
                        (etf['name'] and search.lower() in etf['name'].lower())]
-    else:
-        # 将所有ETF转换为字典列表
-        etfs = [dict(etf) for etf in etfs]
     
-    # 确保只在官方ETF列表中显示官方ETF（is_official=1）
-    etfs = [etf for etf in etfs if etf['is_official'] == 1]
-    
-    # 为每个ETF添加数据统计信息
-    for etf in etfs:
-        etf['data_count'] = get_etf_data_count(etf['symbol'])
-        if etf['data_count'] > 0:
-            start_date, end_date = get_etf_date_range(etf['symbol'])
-            etf['start_date'] = start_date
-            etf['end_date'] = end_date
-    
-    # 为自定义ETF添加数据统计信息
-    for etf in custom_etfs:
-        etf['data_count'] = get_etf_data_count(etf['symbol'])
-        if etf['data_count'] > 0:
-            start_date, end_date = get_etf_date_range(etf['symbol'])
-            etf['start_date'] = start_date
-            etf['end_date'] = end_date
+    # 为官方ETF和自定义ETF添加数据统计信息（一次分组查询）
+    data_stats = get_etf_data_stats([etf['symbol'] for etf in etfs] + [etf['symbol'] for etf in custom_etfs])
+    for etf in etfs + custom_etfs:
+        stats = data_stats.get(etf['symbol'])
+        etf['data_count'] = stats[0] if stats else 0
+        if stats:
+            etf['start_date'], etf['end_date'] = stats[1], stats[2]
     
     return render_template('admin_etf.html', etfs=etfs, custom_etfs=custom_etfs, tab=tab)
 
@@ -3712,9 +3757,8 @@ def admin_etfs():
 @login_required
 @admin_required
 def api_get_etfs():
-    etfs = get_all_etfs()
-    # 将ETF转换为字典列表
-    etfs = [dict(etf) for etf in etfs]
+    # 逐行读取并转换为字典列表
+    etfs = [dict(etf) for etf in iter_all_etfs()]
     return jsonify(etfs)
 
 @app.route('/api/admin/etfs/<symbol>')
@@ -3727,9 +3771,7 @@ def api_get_etf(symbol):
     return jsonify(etf)
 
 @app.route('/api/admin/etfs', methods=['POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_add_etf():
     data = request.json
     
@@ -3752,14 +3794,13 @@ def api_add_etf():
     )
     
     if success:
+        invalidate_official_etf_map()
         return jsonify({'message': message}), 201
     else:
         return jsonify({'error': message}), 400
 
 @app.route('/api/admin/etfs/<path:symbol>', methods=['PUT', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_update_etf(symbol):
     # 检查是否是PUT请求或带有_method=PUT参数的POST请求
     is_put_request = (request.method == 'PUT' or 
@@ -3797,6 +3838,7 @@ def api_update_etf(symbol):
     )
     
     if success:
+        invalidate_official_etf_map()
         # 如果是表单提交，重定向到ETF管理页面
         if request.method == 'POST':
             flash(message, "success")
@@ -3809,45 +3851,40 @@ def api_update_etf(symbol):
             return redirect(url_for('admin_etfs', tab='official'))
         return jsonify({'error': message}), 400
 
-@app.route('/api/admin/etfs/<path:symbol>', methods=['DELETE', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
-def api_delete_etf(symbol):
+def _delete_etf_response(success, message, is_form):
+    """根据删除结果生成响应：表单提交重定向到ETF管理页面，API请求返回JSON"""
+    if is_form:
+        flash(message, "success" if success else "error")
+        return redirect(url_for('admin_etfs', tab='official'))
+    if success:
+        return jsonify({'message': message})
+    return jsonify({'error': message}), 400
+
+def _delete_etf(symbol, is_form):
     """删除官方ETF"""
-    # 检查是否是DELETE请求或带有_method=DELETE参数的POST请求
-    is_delete_request = (request.method == 'DELETE' or 
-                        (request.method == 'POST' and 
-                        (request.args.get('_method') == 'DELETE' or request.form.get('_method') == 'DELETE')))
-    
-    if not is_delete_request:
-        return jsonify({'error': f'不支持的请求方法: {request.method}'}), 405
-    
     # 验证ETF是否存在
-    etf = get_etf_by_symbol(symbol)
-    if not etf:
+    if not etf_exists(symbol):
         return jsonify({'error': 'ETF不存在'}), 404
     
-    # 删除ETF
     success, message, prompt, data_count = delete_etf(symbol)
-    
     if success:
-        # 如果是表单提交，重定向到ETF管理页面
-        if request.method == 'POST':
-            flash(message, "success")
-            return redirect(url_for('admin_etfs', tab='official'))
-        # 如果是API请求，返回JSON响应
-        return jsonify({'message': message})
-    else:
-        if request.method == 'POST':
-            flash(message, "error")
-            return redirect(url_for('admin_etfs', tab='official'))
-        return jsonify({'error': message}), 400
+        invalidate_official_etf_map()
+    return _delete_etf_response(success, message, is_form)
+
+@app.route('/api/admin/etfs/<path:symbol>', methods=['DELETE'])
+@admin_api
+def api_delete_etf(symbol):
+    """删除官方ETF（API请求）"""
+    return _delete_etf(symbol, is_form=False)
+
+@app.route('/api/admin/etfs/<path:symbol>/delete', methods=['POST'])
+@admin_api
+def api_delete_etf_form(symbol):
+    """删除官方ETF（表单提交）"""
+    return _delete_etf(symbol, is_form=True)
 
 @app.route('/api/admin/etfs/<path:symbol>/data', methods=['DELETE', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_clear_etf_data(symbol):
     # 检查是否是DELETE请求或带有_method=DELETE参数的POST请求
     is_delete_request = (request.method == 'DELETE' or 
@@ -3858,14 +3895,14 @@ def api_clear_etf_data(symbol):
         return jsonify({'error': f'不支持的请求方法: {request.method}'}), 405
     
     # 验证ETF是否存在
-    etf = get_etf_by_symbol(symbol)
-    if not etf:
+    if not etf_exists(symbol):
         return jsonify({'error': 'ETF不存在'}), 404
     
     # 清除ETF数据
     success, message = clear_etf_data(symbol)
     
     if success:
+        invalidate_etf_params_cache()
         # 如果是表单提交，重定向到ETF管理页面
         if request.method == 'POST':
             flash(message, "success")
@@ -3879,9 +3916,7 @@ def api_clear_etf_data(symbol):
         return jsonify({'error': message}), 400
 
 @app.route('/api/admin/etfs/data', methods=['DELETE', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_clear_all_etf_data():
     # 检查是否是DELETE请求或带有_method=DELETE参数的POST请求
     is_delete_request = (request.method == 'DELETE' or 
@@ -3891,10 +3926,12 @@ def api_clear_all_etf_data():
     if not is_delete_request:
         return jsonify({'error': f'不支持的请求方法: {request.method}'}), 405
     
-    # 清除所有ETF数据
-    success, message = clear_etf_data()
+    # 清除所有ETF数据，vacuum=1 时同时压缩数据库文件
+    vacuum = request.values.get('vacuum') in ('1', 'true')
+    success, message = clear_etf_data(vacuum=vacuum)
     
     if success:
+        invalidate_etf_params_cache()
         # 如果是表单提交，重定向到ETF管理页面
         if request.method == 'POST':
             flash(message, "success")
@@ -3907,18 +3944,23 @@ def api_clear_all_etf_data():
             return redirect(url_for('admin_etfs', tab='official'))
         return jsonify({'error': message}), 400
 
+@lru_cache(maxsize=1)
+def _eastmoney_names_by_bucket(bucket):
+    """按1小时时间桶缓存东方财富ETF行情快照（代码 -> 名称），获取失败时不缓存"""
+    etf_data = ak.fund_etf_spot_em()
+    return etf_data.drop_duplicates('代码').set_index('代码')['名称']
+
 # 用于从东方财富网获取ETF名称的辅助函数
 def get_etf_name_from_eastmoney(symbol):
-    """从东方财富网获取ETF名称"""
+    """从东方财富网获取ETF名称，行情快照最多缓存1小时，按代码索引查找"""
     try:
         logger.info(f"尝试从东方财富获取ETF {symbol} 信息...")
-        etf_data = ak.fund_etf_spot_em()
+        names = _eastmoney_names_by_bucket(int(time.time() // 3600))
         
         # 查找对应ETF
-        etf_info = etf_data[etf_data['代码'] == symbol]
+        name = names.get(symbol)
         
-        if not etf_info.empty:
-            name = etf_info.iloc[0]['名称']
+        if name is not None:
             logger.info(f"从东方财富获取到ETF名称: {name}")
             return name
         else:
@@ -3969,21 +4011,23 @@ def add_custom_etf():
         return redirect(url_for('user_etf_data', message="ETF代码不能为空", type="error"))
     
     # 检查是否与官方ETF重复
-    official_etfs = get_official_etf_list()
-    for etf in official_etfs:
-        if etf['code'] == symbol:
-            etf_name = etf['name']
-            return redirect(url_for('user_etf_data', message=f"您添加的{etf_name}({symbol})已在官方ETF列表中，无需添加为自定义ETF", type="error"))
+    official_map = get_official_etf_map()
+    if symbol in official_map:
+        etf_name = official_map[symbol]
+        return redirect(url_for('user_etf_data', message=f"您添加的{etf_name}({symbol})已在官方ETF列表中，无需添加为自定义ETF", type="error"))
     
     # 验证是否为有效的ETF/LOF代码
     try:
-        # 尝试获取ETF数据以验证代码有效性
-        df, _ = get_etf_data(symbol)
+        # 获取历史数据和从东方财富网获取名称是两个独立的网络请求，同时进行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            name_future = executor.submit(get_etf_name_from_eastmoney, symbol)
+            # 尝试获取ETF数据以验证代码有效性
+            df, _ = get_etf_data(symbol)
         if df.empty:
             return redirect(url_for('user_etf_data', message=f"无法获取{symbol}的数据，请确认是有效的ETF或LOF代码", type="error"))
         
         # 从东方财富网获取ETF名称
-        name = get_etf_name_from_eastmoney(symbol)
+        name = name_future.result()
         
         # 添加到自定义ETF列表
         success = CustomETF.add(user_id, symbol, name)
@@ -4077,27 +4121,22 @@ def user_etf_data():
             return redirect(url_for('user_etf_data'))
         
         # 检查是否为官方ETF
-        is_official = False
-        official_etfs = get_official_etf_list()
-        for etf in official_etfs:
-            if etf['code'] == symbol:
-                is_official = True
-                break
+        is_official = symbol in get_official_etf_map()
         
         # 计算波动率
-        volatility = calculate_volatility(symbol)
+        volatility = calculate_volatility(symbol, df=df)
         # 计算网格间距
-        grid_spacing = calculate_grid_spacing(symbol)
+        grid_spacing = calculate_grid_spacing(symbol, volatility=volatility)
         # 计算网格范围
-        grid_range = calculate_grid_range(symbol)
+        grid_range = calculate_grid_range(symbol, df=df)
         
-        # 获取最新数据
-        latest_date = df.index[-1]
-        latest_price = df.loc[latest_date, 'close']
+        # 获取最新数据（按位置取最后一行，避免重复的标签查找）
+        latest_price = df['close'].iloc[-1]
         
         # 计算网格上下限
-        upper_limit = grid_range.loc[latest_date, 'H_val']
-        lower_limit = grid_range.loc[latest_date, 'L_val']
+        latest_range = grid_range.iloc[-1]
+        upper_limit = latest_range['H_val']
+        lower_limit = latest_range['L_val']
         
         # 添加安全检查，确保值不是NaN
         data_insufficient = False
@@ -4145,9 +4184,8 @@ def user_etf_data():
             
             current_level = min(max(0, current_level), total_levels)  # 确保在范围内
         
-        # 处理数据用于前端展示
-        df['date_str'] = df.index.strftime('%Y-%m-%d')
-        price_data = df[['date_str', 'close']].values.tolist()
+        # 处理数据用于前端展示，整列转换后再组合，不向df添加临时列
+        price_data = list(zip(df.index.strftime('%Y-%m-%d').tolist(), df['close'].to_numpy().tolist()))
         
         return render_template(
             'user_etf_data.html',
@@ -4171,9 +4209,7 @@ def user_etf_data():
 
 # 添加用户自定义ETF管理端点
 @app.route('/api/admin/custom_etfs/<int:id>', methods=['DELETE', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
+@admin_api
 def api_delete_custom_etf(id):
     # 检查是否是DELETE请求或带有_method=DELETE参数的POST请求
     is_delete_request = (request.method == 'DELETE' or 
@@ -4187,7 +4223,7 @@ def api_delete_custom_etf(id):
     cursor = conn.cursor()
     
     # 查找自定义ETF
-    cursor.execute('SELECT * FROM custom_etfs WHERE id = ?', (id,))
+    cursor.execute('SELECT symbol FROM custom_etfs WHERE id = ?', (id,))
     etf = cursor.fetchone()
     
     if not etf:
@@ -4213,14 +4249,23 @@ def api_etf_info(symbol):
         return jsonify({'error': 'ETF代码不能为空'}), 400
     
     try:
-        # 尝试获取ETF数据以验证代码有效性
-        df, _ = get_etf_data(symbol)
-        if df.empty:
-            return jsonify({'error': f"无法获取{symbol}的数据，请确认是有效的ETF或LOF代码"}), 404
-        
         # 获取ETF名称和最新价格
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        cursor = get_request_db().cursor()
+        
+        # 优先使用数据库中最近一周内的价格记录，命中时无需拉取完整历史数据
+        cursor.execute(
+            "SELECT price FROM etf_data WHERE symbol = ? AND date >= ? ORDER BY date DESC LIMIT 1",
+            (symbol, (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
+        )
+        price_row = cursor.fetchone()
+        if price_row and price_row['price'] is not None:
+            latest_price = float(price_row['price'])
+        else:
+            # 数据库中没有近期记录，获取ETF数据以验证代码有效性
+            df, _ = get_etf_data(symbol)
+            if df.empty:
+                return jsonify({'error': f"无法获取{symbol}的数据，请确认是有效的ETF或LOF代码"}), 404
+            latest_price = float(df['close'].iloc[-1])
         
         # 查询etf_list表获取官方名称
         cursor.execute("SELECT name FROM etf_list WHERE symbol = ?", (symbol,))
@@ -4241,13 +4286,6 @@ def api_etf_info(symbol):
             except:
                 name = f"{symbol} ETF"
         
-        # 获取最新价格
-        latest_price = None
-        if not df.empty:
-            latest_price = float(df.iloc[-1]['close'])
-        
-        conn.close()
-        
         return jsonify({
             'symbol': symbol,
             'name': name,
@@ -4272,48 +4310,28 @@ def test_error():
     raise Exception("这是一个测试错误，用于检查错误处理功能是否正常工作")
 
 # ---------- ETF管理API路由 ---------- #
-@app.route('/api/admin/etfs/id/<int:id>', methods=['DELETE', 'POST'])
-@login_required
-@admin_required
-@check_csrf_token
-def api_delete_etf_by_id(id):
+def _delete_etf_by_id(id, is_form):
     """通过ID删除官方ETF"""
-    # 检查是否是DELETE请求或带有_method=DELETE参数的POST请求
-    is_delete_request = (request.method == 'DELETE' or 
-                        (request.method == 'POST' and 
-                        (request.args.get('_method') == 'DELETE' or request.form.get('_method') == 'DELETE')))
-    
-    if not is_delete_request:
-        return jsonify({'error': f'不支持的请求方法: {request.method}'}), 405
-    
-    # 根据ID获取ETF信息
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM etf_list WHERE id = ?', (id,))
-    etf = cursor.fetchone()
-    conn.close()
-    
-    if not etf:
-        return jsonify({'error': 'ETF不存在'}), 404
-    
-    # 获取ETF代码
-    symbol = etf['symbol']
-    
-    # 删除ETF
-    success, message, prompt, data_count = delete_etf(symbol)
+    # 删除ETF（查找与删除在同一条语句中完成）
+    success, message, prompt, data_count = delete_etf_by_id(id)
     
+    if success is None:
+        return jsonify({'error': message}), 404
     if success:
-        # 如果是表单提交，重定向到ETF管理页面
-        if request.method == 'POST':
-            flash(message, "success")
-            return redirect(url_for('admin_etfs', tab='official'))
-        # 如果是API请求，返回JSON响应
-        return jsonify({'message': message})
-    else:
-        if request.method == 'POST':
-            flash(message, "error")
-            return redirect(url_for('admin_etfs', tab='official'))
-        return jsonify({'error': message}), 400
+        invalidate_official_etf_map()
+    return _delete_etf_response(success, message, is_form)
+
+@app.route('/api/admin/etfs/id/<int:id>', methods=['DELETE'])
+@admin_api
+def api_delete_etf_by_id(id):
+    """通过ID删除官方ETF（API请求）"""
+    return _delete_etf_by_id(id, is_form=False)
+
+@app.route('/api/admin/etfs/id/<int:id>/delete', methods=['POST'])
+@admin_api
+def api_delete_etf_by_id_form(id):
+    """通过ID删除官方ETF（表单提交）"""
+    return _delete_etf_by_id(id, is_form=True)
 
 # 公共回测页面
 @app.route('/public_backtest')
@@ -4347,6 +4365,56 @@ def public_backtest():
     
     return render_template('public_backtest.html', symbols=all_symbols)
 
+def get_portfolio_symbols(portfolio_id, user_id):
+    """获取用户投资组合中的ETF代码集合，在同一请求内只查询一次"""
+    cache = g.setdefault('_portfolio_symbols', {})
+    key = (portfolio_id, user_id)
+    if key not in cache:
+        portfolio = Portfolio.get_by_id(portfolio_id, user_id)
+        cache[key] = {etf['symbol'] for etf in portfolio['etfs']} if portfolio else set()
+    return cache[key]
+
+def etf_params_access_allowed(symbol, user_id, referer, page_context, portfolio_id):
+    """根据页面上下文和用户权限判断是否可以访问ETF参数"""
+    # 官方ETF在所有页面都可以访问
+    if symbol in get_official_etf_map():
+        return True
+    
+    # 对于非官方ETF (自定义ETF)，根据上下文和用户权限进行验证
+    if 'dashboard' in referer or 'dashboard' == page_context or 'history' in referer or 'history' == page_context:
+        # Dashboard和History页面仅允许官方ETF
+        return False
+    if 'public_backtest' in referer or 'public_backtest' == page_context:
+        # Public_backtest页面允许官方ETF和当前用户自己的ETF
+        return bool(user_id) and symbol in get_user_custom_symbols(user_id)
+    if 'portfolio' in referer or 'portfolio' == page_context:
+        # Portfolio页面根据是否有portfolio_id参数决定，ETF需在用户的投资组合中
+        return bool(portfolio_id and user_id) and symbol in get_portfolio_symbols(portfolio_id, user_id)
+    return False
+
+def build_etf_params(symbol):
+    """计算单个ETF的最新波动率、网格间隔和网格上下限"""
+    # 波动率、网格间隔和网格范围一次计算并缓存
+    params = get_etf_params_bundle(symbol)
+    
+    # 波动率
+    latest_volatility_percentage = round(params['volatility'] * 100, 2)
+    
+    # 网格间隔
+    latest_grid_spacing_percentage = round(params['grid_spacing'] * 100, 2)
+    
+    # 网格范围
+    upper_limit = params['upper_limit']
+    lower_limit = params['lower_limit']
+    
+    return {
+        'symbol': symbol,
+        'volatility': latest_volatility_percentage,
+        'grid_spacing': latest_grid_spacing_percentage,
+        'upper_limit': float(upper_limit),
+        'lower_limit': float(lower_limit)
+    }
+
 # 获取ETF参数API
 @app.route('/api/etf_params')
 def get_etf_params():
@@ -4365,76 +4433,57 @@ def get_etf_params():
     if user:
         user_id = get_user_id(user)
     
-    # 验证ETF访问权限
-    access_allowed = False
-    
-    # 检查是否是官方ETF
-    is_official = any(s['code'] == symbol for s in SYMBOLS)
-    
-    if is_official:
-        # 官方ETF在所有页面都可以访问
-        access_allowed = True
-    else:
-        # 对于非官方ETF (自定义ETF)，根据上下文和用户权限进行验证
-        # 判断页面上下文
-        if 'dashboard' in referer or 'dashboard' == page_context or 'history' in referer or 'history' == page_context:
-            # Dashboard和History页面仅允许官方ETF
-            access_allowed = False
-        elif 'public_backtest' in referer or 'public_backtest' == page_context:
-            # Public_backtest页面允许官方ETF和当前用户自己的ETF
-            if user_id:
-                # 检查用户是否有权限访问该ETF
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM custom_etfs WHERE symbol = ? AND user_id = ?', (symbol, user_id))
-                custom_etf = cursor.fetchone()
-                conn.close()
-                
-                if custom_etf:
-                    access_allowed = True
-        elif 'portfolio' in referer or 'portfolio' == page_context:
-            # Portfolio页面根据是否有portfolio_id参数决定
-            if portfolio_id and user_id:
-                # 验证该ETF是否在用户的投资组合中
-                portfolio = Portfolio.get_by_id(portfolio_id, user_id)
-                if portfolio:
-                    # 检查该ETF是否在投资组合中
-                    portfolio_etfs = [etf['symbol'] for etf in portfolio['etfs']]
-                    if symbol in portfolio_etfs:
-                        access_allowed = True
-        
     # 如果无权访问，返回错误
-    if not access_allowed:
+    if not etf_params_access_allowed(symbol, user_id, referer, page_context, portfolio_id):
         return jsonify({'error': '无权访问该ETF参数', 'symbol': symbol}), 403
     
     try:
-        # 计算波动率
-        volatility_series = calculate_volatility(symbol)
-        latest_volatility = volatility_series.iloc[-1]
-        latest_volatility_percentage = round(latest_volatility * 100, 2)
-        
-        # 计算网格间隔
-        grid_spacing_series = calculate_grid_spacing(symbol)
-        latest_grid_spacing = grid_spacing_series.iloc[-1]
-        latest_grid_spacing_percentage = round(latest_grid_spacing * 100, 2)
-        
-        # 计算网格范围
-        grid_range = calculate_grid_range(symbol)
-        latest_range = grid_range.iloc[-1]
-        upper_limit = latest_range['H_val']
-        lower_limit = latest_range['L_val']
-        
-        return jsonify({
-            'symbol': symbol,
-            'volatility': latest_volatility_percentage,
-            'grid_spacing': latest_grid_spacing_percentage,
-            'upper_limit': float(upper_limit),
-            'lower_limit': float(lower_limit)
-        })
+        return jsonify(build_etf_params(symbol))
     except Exception as e:
         app.logger.error(f"获取ETF参数失败: {str(e)}", exc_info=True)
         return jsonify({'error': f'获取ETF参数失败: {str(e)}'}), 500
 
+# 批量获取ETF参数API
+@app.route('/api/etf_params_batch')
+def get_etf_params_batch():
+    """一次请求获取多个ETF的参数，权限检查在请求内共享同一次数据库查询"""
+    symbols = request.args.getlist('symbols[]') or request.args.getlist('symbols')
+    # 同时支持逗号分隔的 symbols=510300,510500
+    symbols = [s.strip() for item in symbols for s in item.split(',') if s.strip()]
+    if not symbols:
+        return jsonify({'error': '未提供ETF代码'}), 400
+    
+    referer = request.headers.get('Referer', '')
+    page_context = request.args.get('context', '')
+    portfolio_id = request.args.get('portfolio_id', '')
+    
+    user = get_current_user()
+    user_id = None
+    if user:
+        user_id = get_user_id(user)
+    
+    results = {}
+    errors = {}
+    allowed = []
+    for symbol in dict.fromkeys(symbols):
+        if etf_params_access_allowed(symbol, user_id, referer, page_context, portfolio_id):
+            allowed.append(symbol)
+        else:
+            errors[symbol] = '无权访问该ETF参数'
+    
+    # 各ETF的数据获取主要在等待网络，用线程池并发计算
+    if allowed:
+        with ThreadPoolExecutor(max_workers=min(8, len(allowed))) as executor:
+            futures = {symbol: executor.submit(build_etf_params, symbol) for symbol in allowed}
+            for symbol, future in futures.items():
+                try:
+                    results[symbol] = future.result()
+                except Exception as e:
+                    app.logger.error(f"获取ETF参数失败 {symbol}: {str(e)}", exc_info=True)
+                    errors[symbol] = f'获取ETF参数失败: {str(e)}'
+    
+    return jsonify({'params': results, 'errors': errors})
+
 # 调试API端点用于检查回测参数
 @app.route('/api/debug_backtest_params', methods=['POST'])
 def debug_backtest_params():
@@ -4448,23 +4497,29 @@ def debug_backtest_params():
         symbol = data.get('symbol')
         
         result = {}
+        df = None
+        # 数据的起止日期（索引已排序，直接取首尾），无数据时为None
+        idx_min = idx_max = None
         if symbol:
-            # 获取ETF数据
+            # 获取ETF数据，后续计算复用同一份数据
             try:
                 df, _ = get_etf_data(symbol)
+                if not df.empty:
+                    idx_min, idx_max = df.index[0], df.index[-1]
                 result['data_status'] = 'success'
                 result['data_count'] = len(df)
                 result['date_range'] = {
-                    'min': df.index.min().strftime('%Y-%m-%d') if not df.empty else None,
-                    'max': df.index.max().strftime('%Y-%m-%d') if not df.empty else None
+                    'min': idx_min.strftime('%Y-%m-%d') if idx_min is not None else None,
+                    'max': idx_max.strftime('%Y-%m-%d') if idx_max is not None else None
                 }
             except Exception as e:
                 result['data_status'] = 'error'
                 result['data_error'] = str(e)
         
             # 获取波动率
+            volatility_series = None
             try:
-                volatility_series = calculate_volatility(symbol)
+                volatility_series = calculate_volatility(symbol, df=df)
                 result['volatility_status'] = 'success'
                 result['volatility_count'] = len(volatility_series)
                 result['latest_volatility'] = float(volatility_series.iloc[-1]) if not volatility_series.empty else None
@@ -4474,7 +4529,7 @@ def debug_backtest_params():
             
             # 获取网格间隔
             try:
-                grid_spacing_series = calculate_grid_spacing(symbol)
+                grid_spacing_series = calculate_grid_spacing(symbol, df=df, volatility=volatility_series)
                 result['grid_spacing_status'] = 'success'
                 result['grid_spacing_count'] = len(grid_spacing_series)
                 result['latest_grid_spacing'] = float(grid_spacing_series.iloc[-1]) if not grid_spacing_series.empty else None
@@ -4484,7 +4539,7 @@ def debug_backtest_params():
             
             # 获取网格范围
             try:
-                grid_range = calculate_grid_range(symbol)
+                grid_range = calculate_grid_range(symbol, df=df)
                 result['grid_range_status'] = 'success'
                 result['grid_range_count'] = len(grid_range)
                 if not grid_range.empty:
@@ -4510,10 +4565,8 @@ def debug_backtest_params():
                 }
                 
                 # 检查日期是否在有效范围内
-                if symbol and not df.empty:
-                    in_range = ((start_date_parsed >= df.index.min()) and 
-                               (end_date_parsed <= df.index.max()))
-                    result['dates_in_data_range'] = in_range
+                if idx_min is not None:
+                    result['dates_in_data_range'] = start_date_parsed >= idx_min and end_date_parsed <= idx_max
             except Exception as e:
                 result['date_parsing'] = 'error'
                 result['date_error'] = str(e)
@@ -4527,6 +4580,72 @@ def debug_backtest_params():
         app.logger.error(f"调试API错误: {str(e)}", exc_info=True)
         return jsonify({'error': f'调试失败: {str(e)}'}), 500
 
+# 公共回测的可选数值参数：(字段名, 除数, 错误提示)，波动率和网格间隔以百分比传入
+_BACKTEST_OPTIONAL_PARAMS = (
+    ('volatility', 100, '自定义波动率参数无效'),
+    ('grid_spacing', 100, '自定义网格间隔参数无效'),
+    ('grid_range_upper', 1, '自定义上限价格参数无效'),
+    ('grid_range_lower', 1, '自定义下限价格参数无效'),
+)
+_BACKTEST_GRID_TYPES = frozenset(('volatility', 'arithmetic', 'geometric'))
+
+def parse_backtest_params(data):
+    """校验并转换公共回测参数，返回 (backtest_single_etf 的关键字参数, 错误信息)"""
+    # 初始资金
+    try:
+        initial_capital = float(data.get('initial_capital', 100000))
+    except (ValueError, TypeError):
+        return None, '初始资金参数无效'
+    
+    # 日期范围
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    if not start_date or not end_date:
+        return None, '未提供回测日期范围'
+    
+    # 网格层数
+    try:
+        grid_levels = int(data.get('grid_levels', 10))
+    except (ValueError, TypeError):
+        return None, '网格层数参数无效'
+    if grid_levels < 3 or grid_levels > 50:
+        return None, '网格层数必须在3-50之间'
+    
+    # 网格类型
+    grid_type = data.get('grid_type', 'volatility')
+    if grid_type not in _BACKTEST_GRID_TYPES:
+        return None, '无效的网格类型'
+    
+    params = {
+        'initial_capital': initial_capital,
+        'grid_levels': grid_levels,
+        'grid_type': grid_type,
+    }
+    
+    # 可选参数（未提供或为空时为None）
+    for key, divisor, message in _BACKTEST_OPTIONAL_PARAMS:
+        value = data.get(key)
+        if not value:
+            params[key] = None
+            continue
+        try:
+            params[key] = float(value) / divisor
+        except (ValueError, TypeError):
+            return None, message
+    
+    # 将日期字符串转换为日期对象
+    try:
+        params['start_date'] = pd.to_datetime(start_date)
+        params['end_date'] = pd.to_datetime(end_date)
+    except Exception:
+        return None, '日期格式无效'
+    
+    # 确保日期范围有效
+    if params['start_date'] >= params['end_date']:
+        return None, '开始日期必须早于结束日期'
+    
+    return params, None
+
 # 公共回测API
 @app.route('/api/public_backtest', methods=['POST'])
 def api_public_backtest():
@@ -4535,7 +4654,8 @@ def api_public_backtest():
         if not data:
             return jsonify({'error': '无法解析请求数据'}), 400
         
-        app.logger.info(f"接收到回测请求: {data}")
+        # 使用惰性格式化，日志级别未开启INFO时不会格式化整个请求数据
+        app.logger.info("接收到回测请求: %s", data)
         
         # 提取参数
         symbol = data.get('symbol')
@@ -4552,7 +4672,7 @@ def api_public_backtest():
             user_id = get_user_id(user)
         
         # 检查是否是官方ETF
-        is_official = any(s['code'] == symbol for s in SYMBOLS)
+        is_official = symbol in OFFICIAL_CODES
         
         if is_official:
             # 官方ETF在所有页面都可以访问
@@ -4561,112 +4681,34 @@ def api_public_backtest():
             # 对于非官方ETF (自定义ETF)，只有当前用户自己的ETF才能访问
             if user_id:
                 # 检查用户是否有权限访问该ETF
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM custom_etfs WHERE symbol = ? AND user_id = ?', (symbol, user_id))
-                custom_etf = cursor.fetchone()
-                conn.close()
-                
-                if custom_etf:
+                if symbol in get_user_custom_symbols(user_id):
                     access_allowed = True
         
         # 如果无权访问，返回错误
         if not access_allowed:
             return jsonify({'error': '无权访问该ETF进行回测', 'symbol': symbol}), 403
             
-        # 初始资金
-        try:
-            initial_capital = float(data.get('initial_capital', 100000))
-        except (ValueError, TypeError):
-            return jsonify({'error': '初始资金参数无效'}), 400
-        
-        # 日期范围
-        start_date = data.get('start_date')
-        end_date = data.get('end_date')
-        if not start_date or not end_date:
-            return jsonify({'error': '未提供回测日期范围'}), 400
+        # 校验并转换回测参数
+        params, error = parse_backtest_params(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # 网格层数
-        try:
-            grid_levels = int(data.get('grid_levels', 10))
-            if grid_levels < 3 or grid_levels > 50:
-                return jsonify({'error': '网格层数必须在3-50之间'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'error': '网格层数参数无效'}), 400
-        
-        # 网格类型
-        grid_type = data.get('grid_type', 'volatility')
-        if grid_type not in ['volatility', 'arithmetic', 'geometric']:
-            return jsonify({'error': '无效的网格类型'}), 400
-        
-        # 可选参数（如果提供）
-        volatility = None
-        grid_spacing = None
-        grid_range_upper = None
-        grid_range_lower = None
-        
-        # 处理自定义波动率
-        if 'volatility' in data and data['volatility']:
-            try:
-                volatility = float(data.get('volatility')) / 100  # 百分比转为小数
-            except (ValueError, TypeError):
-                return jsonify({'error': '自定义波动率参数无效'}), 400
-        
-        # 处理自定义网格间隔
-        if 'grid_spacing' in data and data['grid_spacing']:
-            try:
-                grid_spacing = float(data.get('grid_spacing')) / 100  # 百分比转为小数
-            except (ValueError, TypeError):
-                return jsonify({'error': '自定义网格间隔参数无效'}), 400
-        
-        # 处理自定义上下限
-        if 'grid_range_upper' in data and data['grid_range_upper']:
-            try:
-                grid_range_upper = float(data.get('grid_range_upper'))
-            except (ValueError, TypeError):
-                return jsonify({'error': '自定义上限价格参数无效'}), 400
-                
-        if 'grid_range_lower' in data and data['grid_range_lower']:
-            try:
-                grid_range_lower = float(data.get('grid_range_lower'))
-            except (ValueError, TypeError):
-                return jsonify({'error': '自定义下限价格参数无效'}), 400
-        
-        # 将日期字符串转换为日期对象
-        try:
-            start_date = pd.to_datetime(start_date)
-            end_date = pd.to_datetime(end_date)
-        except Exception:
-            return jsonify({'error': '日期格式无效'}), 400
-        
-        # 确保日期范围有效
-        if start_date >= end_date:
-            return jsonify({'error': '开始日期必须早于结束日期'}), 400
-        
-        app.logger.info(f"准备执行回测: symbol={symbol}, initial_capital={initial_capital}, dates={start_date} to {end_date}, grid_levels={grid_levels}, grid_type={grid_type}")
+        initial_capital = params['initial_capital']
+        app.logger.info("准备执行回测: symbol=%s, initial_capital=%s, dates=%s to %s, grid_levels=%s, grid_type=%s",
+                        symbol, initial_capital, params['start_date'], params['end_date'],
+                        params['grid_levels'], params['grid_type'])
         
         # 执行回测
-        result = backtest_single_etf(
-            symbol, 
-            initial_capital, 
-            start_date, 
-            end_date, 
-            grid_levels, 
-            grid_type,
-            volatility,
-            grid_spacing,
-            grid_range_upper,
-            grid_range_lower
-        )
+        result = backtest_single_etf(symbol, **params)
         
         # 检查是否有错误
         if 'error' in result:
             app.logger.error(f"回测失败: {result['error']}")
             return jsonify({'error': result['error']}), 400
         
-        # 处理日期数据以便JSON序列化
-        if 'dates' in result:
-            result['dates'] = [d.strftime('%Y-%m-%d') if isinstance(d, pd.Timestamp) else d for d in result['dates']]
+        # 处理日期数据以便JSON序列化（backtest_single_etf 已返回字符串时无需转换）
+        if result.get('dates') and not isinstance(result['dates'][0], str):
+            result['dates'] = pd.DatetimeIndex(result['dates']).strftime('%Y-%m-%d').tolist()
         
         # 计算并添加更多指标
         if 'total_equity' in result and len(result['total_equity']) > 0:
@@ -4696,7 +4738,8 @@ def api_public_backtest():
             result['trade_count'] = 0
             result['trades'] = []
         
-        app.logger.info(f"回测完成: {symbol}, 年化收益={result.get('annual_return', '未知')}%, 夏普比率={result.get('sharpe_ratio', '未知')}")
+        app.logger.info("回测完成: %s, 年化收益=%s%%, 夏普比率=%s",
+                        symbol, result.get('annual_return', '未知'), result.get('sharpe_ratio', '未知'))
         
         return jsonify(result)
         
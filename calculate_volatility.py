@@ -1,129 +1,258 @@
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 import akshare as ak
 import warnings
+import math
 import time
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import os
 
 # 忽略警告
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-# 修复 quantstats 中的问题
-def safe_product(arr):
-    return np.prod(arr)
+# 年化系数（一年252个交易日）
+_ANNUALIZATION = math.sqrt(252)
 
-from quantstats.stats import _np
-_np.product = safe_product
+# 限制同时访问akshare的请求数，避免被远端限流
+_FETCH_SEMAPHORE = threading.Semaphore(4)
+
+# 历史数据磁盘缓存目录；截止日期为当天的数据在收盘后才固定
+CACHE_DIR = 'cache'
+MARKET_CLOSE_HOUR = 15
+
+def _cache_path(symbol, end_date):
+    return os.path.join(CACHE_DIR, f"{symbol}_{end_date}.pkl")
+
+def _load_cached_data(symbol, end_date):
+    """读取缓存的历史数据，缓存不存在或可能不完整时返回 None"""
+    path = _cache_path(symbol, end_date)
+    if not os.path.exists(path):
+        return None
+    now = datetime.now()
+    if end_date >= now.strftime("%Y%m%d"):
+        # 截止到今天的数据，只认今天收盘后写入的缓存
+        mtime = datetime.fromtimestamp(os.path.getmtime(path))
+        if mtime.date() != now.date() or mtime.hour < MARKET_CLOSE_HOUR:
+            return None
+    try:
+        return pd.read_pickle(path)
+    except Exception:
+        return None
+
+def _save_cached_data(symbol, end_date, df):
+    """写入缓存，先写临时文件再替换，避免并行运行时读到半个文件"""
+    now = datetime.now()
+    if end_date >= now.strftime("%Y%m%d") and now.hour < MARKET_CLOSE_HOUR:
+        # 收盘前当天数据还会变化，不写缓存
+        return
+    path = _cache_path(symbol, end_date)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"写入缓存失败: {e}")
 
 def get_etf_data(symbol, end_date=None):
     """获取ETF/LOF数据"""
     max_retries = 3
     if end_date is None:
         end_date = datetime.now().strftime("%Y%m%d")
+    cached = _load_cached_data(symbol, end_date)
+    if cached is not None:
+        return cached, symbol
     for retry in range(max_retries):
         try:
-            df = ak.fund_etf_hist_em(
-                    symbol=symbol, 
-                    period="daily", 
-                    start_date="20121210", 
-                    end_date=end_date,
-                    adjust="qfq"
-                )    
+            with _FETCH_SEMAPHORE:
+                df = ak.fund_etf_hist_em(
+                        symbol=symbol, 
+                        period="daily", 
+                        start_date="20121210", 
+                        end_date=end_date,
+                        adjust="qfq"
+                    )    
             # 只保留需要的列并重命名
             df = df.rename(columns={
                 '日期': 'date',
                 '收盘': 'close',
             })
-            df['date'] = pd.to_datetime(df['date'])
+            # 日期固定为 YYYY-MM-DD，显式指定格式以跳过逐行的格式推断
+            df['date'] = pd.to_datetime(df['date'], format='%Y-%m-%d')
             df.set_index('date', inplace=True)
-            df.sort_index(inplace=True)
+            # AkShare 返回的数据已按日期升序，只有乱序时才排序
+            if not df.index.is_monotonic_increasing:
+                df.sort_index(inplace=True)
+            # 后续计算只用到收盘价，只保留 close 列以减少内存占用和复制开销
+            df = df[['close']].astype(np.float64)
+            _save_cached_data(symbol, end_date, df)
             
             return df, symbol
         except Exception as e:
             if retry < max_retries - 1:
                 print(f"第{retry + 1}次获取数据失败，正在重试...")
-                time.sleep(5)
+                # 指数退避：1秒、2秒……
+                time.sleep(2 ** retry)
             else:
                 print(f"获取数据失败: {str(e)}")
                 raise
 
+def _rolling_std(values, window):
+    """O(N) 滚动样本标准差，窗口内有缺失值时结果为 NaN（与 pandas rolling(window).std() 一致）
+
+    先减去整体均值再做累加，避免大数相减造成的精度损失
+    """
+    result = np.full(len(values), np.nan)
+    if window < 2 or len(values) < window:
+        return result
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return result
+    centered = np.where(valid, values - values[valid].mean(), 0.0)
+    s1 = np.concatenate(([0.0], np.cumsum(centered)))
+    s2 = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    count = np.concatenate(([0], np.cumsum(valid)))
+    win_s1 = s1[window:] - s1[:-window]
+    win_s2 = s2[window:] - s2[:-window]
+    full = (count[window:] - count[:-window]) == window
+    var = np.maximum(win_s2 - win_s1 * win_s1 / window, 0.0) / (window - 1)
+    result[window - 1:] = np.where(full, np.sqrt(var), np.nan)
+    return result
+
 # 200日波动率
-def calculate_volatility(symbol, window=200):
-    df, _ = get_etf_data(symbol)
-    # 计算日收益率
-    daily_returns = df['close'].pct_change()
-    # 计算滚动标准差
-    rolling_std = daily_returns.rolling(window=window).std()
-    # 转换为年化波动率 (假设一年252个交易日)
-    annual_vol = rolling_std * np.sqrt(252)
-    return annual_vol
+def calculate_volatility(symbol, window=200, df=None):
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    closes = df['close'].to_numpy(dtype=np.float64)
+    # 计算日收益率（与 pct_change 相同，首日为 NaN）
+    daily_returns = np.full(len(closes), np.nan)
+    np.divide(closes[1:], closes[:-1], out=daily_returns[1:])
+    daily_returns[1:] -= 1
+    # 计算滚动标准差，并原地转换为年化波动率
+    annual_vol = _rolling_std(daily_returns, window)
+    annual_vol *= _ANNUALIZATION
+    return pd.Series(annual_vol, index=df.index, name='close')
 
 # 网格间隔
-def calculate_grid_spacing(symbol, window=200):
+def calculate_grid_spacing(symbol, window=200, df=None, volatility=None):
     """计算网格间隔"""
-    volatility = calculate_volatility(symbol, window)
+    if volatility is None:
+        volatility = calculate_volatility(symbol, window, df=df)
     grid_spacing = volatility / 8
     return grid_spacing
 
+def _rolling_max_min(values, window):
+    """滚动最大/最小值，用 sliding_window_view 对每个窗口求最大/最小值（O(N·window)），前 window-1 个位置为 NaN"""
+    high = np.full(len(values), np.nan)
+    low = np.full(len(values), np.nan)
+    if window <= len(values):
+        windows = sliding_window_view(values, window)
+        high[window - 1:] = windows.max(axis=1)
+        low[window - 1:] = windows.min(axis=1)
+    return high, low
+
+def _merge_windows(rolled, window, times, ufunc):
+    """把 times 个首尾相接的 window 日滚动结果合并成 window*times 日的滚动结果"""
+    n = len(rolled)
+    span = window * times
+    result = np.full(n, np.nan)
+    if span <= n:
+        result[span - 1:] = ufunc.reduce([rolled[span - 1 - k * window:n - k * window] for k in range(times)])
+    return result
+
 # 网格总区间
-def calculate_grid_range(symbol):
+def calculate_grid_range(symbol, df=None):
     """计算网格总区间"""
-    df, _ = get_etf_data(symbol)
-    close = df['close']
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    close = df['close'].to_numpy(dtype=np.float64)
     
-    # 计算100日和500日的高点和低点
-    high_100 = close.rolling(window=200).max()
-    low_100 = close.rolling(window=200).min()
-    high_500 = close.rolling(window=800).max() 
-    low_500 = close.rolling(window=800).min()
+    # 计算100日和500日的高点和低点（800日窗口由4个200日窗口合并，不再重新扫描）
+    high_100, low_100 = _rolling_max_min(close, 200)
+    high_500 = _merge_windows(high_100, 200, 4, np.maximum)
+    low_500 = _merge_windows(low_100, 200, 4, np.minimum)
     
-    # 根据公式计算上下限
-    H = 0.7 * high_100 + 0.3 * high_500
-    L = 0.7 * low_100 + 0.3 * low_500
+    # 根据公式计算上下限，直接复用滚动结果的缓冲区，不再分配临时数组
+    H = np.multiply(high_100, 0.7, out=high_100)
+    H += np.multiply(high_500, 0.3, out=high_500)
+    L = np.multiply(low_100, 0.7, out=low_100)
+    L += np.multiply(low_500, 0.3, out=low_500)
     
     # 返回一个 DataFrame，确保索引与 df 一致
     return pd.DataFrame({'H_val': H, 'L_val': L}, index=df.index)
 
 
-def backtest_grid_strategy(symbol, start_date, end_date, initial_capital=100000, grid_levels=10):
-    """使用简单网格策略对ETF进行回测"""
-    df, _ = get_etf_data(symbol)
-    df = df[(df.index >= start_date) & (df.index <= end_date)].copy()
-    if df.empty:
-        raise ValueError("指定日期范围内无数据")
-
-    grid_range = calculate_grid_range(symbol)
-    grid_spacing = calculate_grid_spacing(symbol)
-
-    lower = grid_range['L_val'].iloc[-1]
-    spacing = grid_spacing.iloc[-1]
-    invest_per_level = initial_capital / grid_levels
+def _grid_loop(closes, lower, spacing, invest_per_level, cash):
+    """网格回测核心循环，只处理 numpy 数组，返回成交的位置、方向和数量"""
+    levels = (closes - lower) / (spacing * lower)
+    if not np.isfinite(levels).all():
+        raise ValueError("价格或网格参数包含无效值")
+    levels = levels.astype(np.int64).tolist()
+    prices = closes.tolist()
 
-    cash = initial_capital
     position = 0.0
-    trades = []
-
-    prev_level = int((df['close'].iloc[0] - lower) / (spacing * lower))
-
-    for date, price in df['close'].items():
-        level = int((price - lower) / (spacing * lower))
+    trade_idx = []
+    trade_type = []
+    trade_qty = []
 
+    prev_level = levels[0]
+    for i, (level, price) in enumerate(zip(levels, prices)):
         while level < prev_level and cash >= invest_per_level:
             qty = invest_per_level / price
             cash -= invest_per_level
             position += qty
-            trades.append({"date": date.strftime('%Y-%m-%d'), "type": 'buy', "price": round(price, 2), "quantity": round(qty, 2)})
+            trade_idx.append(i)
+            trade_type.append('buy')
+            trade_qty.append(qty)
             prev_level -= 1
 
         while level > prev_level and position > 0:
             qty = invest_per_level / price
             cash += qty * price
             position -= qty
-            trades.append({"date": date.strftime('%Y-%m-%d'), "type": 'sell', "price": round(price, 2), "quantity": round(qty, 2)})
+            trade_idx.append(i)
+            trade_type.append('sell')
+            trade_qty.append(qty)
             prev_level += 1
 
-    final_equity = cash + position * df['close'].iloc[-1]
+    return cash, position, trade_idx, trade_type, trade_qty
+
+def backtest_grid_strategy(symbol, start_date, end_date, initial_capital=100000, grid_levels=10, df=None):
+    """使用简单网格策略对ETF进行回测，df 为已获取的完整数据时不再重复获取"""
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    # 索引已按日期排序，用二分查找定位回测区间，避免整列布尔掩码和复制
+    lo = df.index.searchsorted(pd.Timestamp(start_date), side='left')
+    hi = df.index.searchsorted(pd.Timestamp(end_date), side='right')
+    if hi <= lo:
+        raise ValueError("指定日期范围内无数据")
+    dates = df.index[lo:hi]
+    closes = df['close'].to_numpy(dtype=np.float64)[lo:hi]
+
+    grid_range = calculate_grid_range(symbol, df=df)
+    grid_spacing = calculate_grid_spacing(symbol, df=df)
+
+    lower = grid_range['L_val'].iloc[-1]
+    spacing = grid_spacing.iloc[-1]
+    invest_per_level = initial_capital / grid_levels
+
+    cash, position, trade_idx, trade_type, trade_qty = _grid_loop(
+        closes, lower, spacing, invest_per_level, initial_capital
+    )
+
+    # 成交日期在循环结束后统一格式化
+    trade_dates = dates[trade_idx].strftime('%Y-%m-%d').tolist()
+    trade_prices = closes[trade_idx].tolist()
+    trades = [
+        {"date": date, "type": kind, "price": round(price, 2), "quantity": round(qty, 2)}
+        for date, kind, price, qty in zip(trade_dates, trade_type, trade_prices, trade_qty)
+    ]
+
+    final_equity = cash + position * closes[-1]
     return {
         'final_equity': final_equity,
         'return_pct': (final_equity / initial_capital - 1) * 100,
@@ -131,6 +260,61 @@ def backtest_grid_strategy(symbol, start_date, end_date, initial_capital=100000,
     }
 
 
+def grid_position(upper, lower, spacing, price):
+    """计算总区间百分比、网格层数、当前所处网格层数和仓位
+
+    参数可以是标量，也可以是多个ETF对应的等长数组，全部用 numpy 逐元素计算
+    """
+    upper, lower, spacing, price = (np.asarray(v, dtype=np.float64) for v in (upper, lower, spacing, price))
+    range_pct = 2 * (upper - lower) / (upper + lower)
+    grid_levels = np.round(range_pct / spacing)
+    current_level = np.where(price <= lower, 0,
+                             np.where(price >= upper, grid_levels,
+                                      np.round((price - lower) / (spacing * lower))))
+    # 将仓位限制在0-1之间
+    position = np.clip(1 - current_level / grid_levels, 0, 1)
+    return range_pct, grid_levels.astype(int), current_level.astype(int), position
+
+def report_symbol(symbol_info, specific_date, full_df=None):
+    """计算单个ETF的网格参数和回测结果，返回要输出的文本行；full_df 为已获取的完整数据时不再重复获取"""
+    lines = [f"\n正在处理 {symbol_info['name']} ({symbol_info['code']})"]
+    symbol = symbol_info['code']
+    # 只获取一次完整数据，指定日期的数据从中截取
+    if full_df is None:
+        full_df, _ = get_etf_data(symbol)
+    df = full_df.loc[:pd.Timestamp(specific_date)]
+    
+    # 计算波动率、网格间隔和网格总区间，最新值只取一次
+    volatility = calculate_volatility(symbol, df=full_df)
+    grid_spacing = calculate_grid_spacing(symbol, volatility=volatility)
+    grid_range = calculate_grid_range(symbol, df=full_df)
+    vol_last = float(volatility.iat[-1])
+    spacing_last = float(grid_spacing.iat[-1])
+    upper_last = float(grid_range['H_val'].iat[-1])
+    lower_last = float(grid_range['L_val'].iat[-1])
+    lines.append(f"最新波动率: {round(vol_last * 100)}%")
+    lines.append(f"最新网格间隔: {round(spacing_last * 100, 1)}%")
+    lines.append(f"最新网格总区间: 上限 {upper_last:.2f}, 下限 {lower_last:.2f}")
+    # 计算当前价格
+    current_price = float(df['close'].iat[-1])
+    # 计算总区间百分比、网格层数、当前所处的网格层数和当前仓位
+    range_pct, grid_levels, current_level, position = grid_position(
+        upper_last, lower_last, spacing_last, current_price)
+    grid_levels = int(grid_levels)
+    lines.append(f"总区间百分比: {round(float(range_pct) * 100)}%")
+    lines.append(f"网格层数: {grid_levels}")
+    lines.append(f"当前价格: {current_price:.2f}")
+    lines.append(f"当前所处网格层数: {int(current_level)}")
+    lines.append(f"当前仓位: {round(float(position) * 100)}%")
+
+    # 回测网格策略
+    try:
+        result = backtest_grid_strategy(symbol, '20200101', specific_date, grid_levels=grid_levels, df=full_df)
+        lines.append(f"回测收益率: {result['return_pct']:.2f}%")
+    except Exception as e:
+        lines.append(f"回测失败: {e}")
+    return lines
+
 # 使用示例
 if __name__ == "__main__":
     symbols = [
@@ -167,51 +351,12 @@ if __name__ == "__main__":
             {"name": "黄金 ETF", "code": "518800"},
             {"name": "豆粕 ETF", "code": "159985"},
         ]
-    # 示例：获取指定日期的数据
-    specific_date = "20250310"  # 指定日期
-    for symbol_info in symbols:
-        print(f"\n正在处理 {symbol_info['name']} ({symbol_info['code']})")
-        symbol = symbol_info['code']
-        # 获取指定日期的数据
-        df, _ = get_etf_data(symbol, end_date=specific_date)
-        
-        # 计算波动率
-        volatility = calculate_volatility(symbol)
-        print(f"最新波动率: {round(volatility.iloc[-1] * 100)}%")
-        # 计算网格间隔
-        grid_spacing = calculate_grid_spacing(symbol)
-        print(f"最新网格间隔: {round(grid_spacing.iloc[-1] * 100, 1)}%")
-        # 计算网格总区间
-        grid_range = calculate_grid_range(symbol)
-        print(f"最新网格总区间: 上限 {grid_range['H_val'].iloc[-1]:.2f}, 下限 {grid_range['L_val'].iloc[-1]:.2f}")
-        # 计算总区间百分比
-        range_pct = 2 * (grid_range['H_val'].iloc[-1] - grid_range['L_val'].iloc[-1]) / (grid_range['H_val'].iloc[-1] + grid_range['L_val'].iloc[-1])
-        print(f"总区间百分比: {round(range_pct * 100)}%")
-        # 计算网格层数
-        grid_levels = round(range_pct / grid_spacing.iloc[-1])
-        print(f"网格层数: {grid_levels}")
-        # 计算当前价格
-        current_price = df['close'].iloc[-1]
-        print(f"当前价格: {current_price:.2f}")
-        
-        # 计算当前所处的网格层数
-        if current_price <= grid_range['L_val'].iloc[-1]:
-            current_level = 0
-        elif current_price >= grid_range['H_val'].iloc[-1]:
-            current_level = grid_levels
-        else:
-            current_level = round((current_price - grid_range['L_val'].iloc[-1]) / (grid_spacing.iloc[-1] * grid_range['L_val'].iloc[-1]))
-        print(f"当前所处网格层数: {current_level}")
-        
-        # 计算当前仓位
-        total_levels = grid_levels
-        position = 1 - current_level / total_levels
-        position = max(0, min(1, position))  # 将仓位限制在0-1之间
-        print(f"当前仓位: {round(position * 100)}%")
-
-        # 回测网格策略
-        try:
-            result = backtest_grid_strategy(symbol, '20200101', specific_date, grid_levels=grid_levels)
-            print(f"回测收益率: {result['return_pct']:.2f}%")
-        except Exception as e:
-            print(f"回测失败: {e}")
+    # 示例：获取指定日期的数据
+    specific_date = "20250310"  # 指定日期
+    # 网络请求受 _FETCH_SEMAPHORE 限流，在本进程用线程并行获取；
+    # 之后各ETF的指标计算和回测是相互独立的CPU密集任务，分发到多个进程后按原顺序输出
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        frames = list(executor.map(lambda symbol_info: get_etf_data(symbol_info['code'])[0], symbols))
+    with ProcessPoolExecutor() as executor:
+        for lines in executor.map(report_symbol, symbols, [specific_date] * len(symbols), frames):
+            print("\n".join(lines))
@@ -8,7 +8,8 @@ print(f"数据库文件是否存在: {os.path.exists(db_path)}")
 
 if os.path.exists(db_path):
     try:
-        conn = sqlite3.connect(db_path)
+        # 只读检查，不需要 sqlite3 模块隐式开启事务
+        conn = sqlite3.connect(db_path, isolation_level=None)
         cursor = conn.cursor()
         
         # 查看所有表
@@ -24,7 +25,7 @@ if os.path.exists(db_path):
             print(f"etf_list 表结构: {columns}")
             
             # 查看 510300 的数据
-            cursor.execute("SELECT * FROM etf_list WHERE symbol = '510300'")
+            cursor.execute("SELECT symbol, name, weight, category FROM etf_list WHERE symbol = ?", ('510300',))
             data = cursor.fetchall()
             print(f"510300 的数据: {data}")
             
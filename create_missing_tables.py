@@ -3,6 +3,8 @@ import os
 import time
 from datetime import datetime
 
+from models.user import migrate_portfolio_etfs_unique
+
 def get_db_connection():
     """获取数据库连接"""
     conn = sqlite3.connect('database/etf_history.db')
@@ -14,6 +16,9 @@ def check_and_create_tables():
     print("开始检查数据库表...")
     
     conn = get_db_connection()
+    # 切换为WAL日志（持久保存在数据库文件中，之后的连接都会沿用）
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     cursor = conn.cursor()
     
     # 获取当前所有表
@@ -102,6 +107,7 @@ def check_and_create_tables():
     # 索引定义
     indexes = {
         'idx_portfolios_user_id': 'CREATE INDEX IF NOT EXISTS idx_portfolios_user_id ON portfolios (user_id)',
+        'idx_portfolios_user_created': 'CREATE INDEX IF NOT EXISTS idx_portfolios_user_created ON portfolios (user_id, created_at DESC)',
         'idx_portfolio_etfs_portfolio_id': 'CREATE INDEX IF NOT EXISTS idx_portfolio_etfs_portfolio_id ON portfolio_etfs (portfolio_id)',
         'idx_favorite_etfs_user_id': 'CREATE INDEX IF NOT EXISTS idx_favorite_etfs_user_id ON favorite_etfs (user_id)',
         'idx_custom_etfs_user_id': 'CREATE INDEX IF NOT EXISTS idx_custom_etfs_user_id ON custom_etfs (user_id)',
@@ -123,6 +129,13 @@ def check_and_create_tables():
             print(f"创建索引 {index_name}...")
             cursor.execute(create_statement)
         
+        # 迁移：portfolio_etfs (portfolio_id, symbol) 唯一索引，Portfolio.add_etf 的 UPSERT 依赖它
+        deleted = migrate_portfolio_etfs_unique(cursor)
+        if deleted is None:
+            print("portfolio_etfs 唯一索引已存在，跳过")
+        else:
+            print(f"portfolio_etfs 唯一索引创建成功，删除重复记录 {deleted} 条")
+        
         conn.commit()
         print("所有表和索引创建完成!")
     except Exception as e:
@@ -6,6 +6,7 @@ import sys
 import time
 import os
 from datetime import datetime
+from functools import cached_property
 
 # 配置日志
 logging.basicConfig(
@@ -26,35 +27,75 @@ class ETFNameFetcher:
         self.etf_dict = {
             
         }
+        # 复用的数据库连接，以及etf_list是否有updated_at列（只检查一次）
+        self._conn = None
+        self._has_updated_at = None
     
-    def get_etf_name_from_eastmoney(self, symbol):
-        """从东方财富网获取ETF名称"""
-        try:
-            logging.info(f"尝试从东方财富获取ETF {symbol} 信息...")
-            etf_data = ak.fund_etf_spot_em()
-            
-            # 调试：打印列名和数据形状
-            logging.info(f"获取到ETF数据，形状: {etf_data.shape}, 列名: {list(etf_data.columns)}")
-            
-            # 检查具体内容
-            if not etf_data.empty:
-                sample = etf_data.head(3)
-                logging.info(f"数据样例:\n{sample}")
-
-            # 查找对应ETF
-            etf_info = etf_data[etf_data['代码'] == symbol]
-            
-            if not etf_info.empty:
-                name = etf_info.iloc[0]['名称']
-                logging.info(f"从东方财富获取到ETF名称: {name}")
-                return name, True
-            else:
-                logging.warning(f"在东方财富数据中未找到ETF {symbol}")
-                return None, False
+    def _get_conn(self):
+        """获取复用的数据库连接"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path)
+            # 与应用一致使用WAL日志，批量写入只在提交时同步一次
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        return self._conn
+    
+    def close(self):
+        """关闭数据库连接"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def _cached_frame(self, name, loader, ttl=3600):
+        """以数据表形式把 loader 返回的 DataFrame 持久化在数据库中，ttl 秒内再次运行直接读取，不再访问网络"""
+        conn = self._get_conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS _cache_meta (name TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+        row = conn.execute("SELECT mtime FROM _cache_meta WHERE name = ?", (name,)).fetchone()
+        if row and time.time() - row[0] < ttl:
+            logging.info(f"使用数据库中缓存的 {name}")
+            return pd.read_sql_query(f'SELECT * FROM "{name}"', conn)
+        
+        df = loader()
+        df.to_sql(name, conn, if_exists='replace', index=False)
+        conn.execute("INSERT OR REPLACE INTO _cache_meta (name, mtime) VALUES (?, ?)", (name, time.time()))
+        conn.commit()
+        return df
+    
+    @cached_property
+    def _spot_names(self):
+        """东方财富ETF实时行情快照（代码 -> 名称），每个实例只获取一次，失败时重试；快照在数据库中缓存1小时"""
+        max_retries = 3
+        for retry in range(max_retries):
+            try:
+                logging.info("尝试从东方财富获取ETF列表...")
+                etf_data = self._cached_frame('cache_etf_spot_em', ak.fund_etf_spot_em)
                 
-        except Exception as e:
-            logging.error(f"从东方财富获取ETF名称失败: {str(e)}", exc_info=True)
-            return None, False
+                # 调试：打印列名和数据形状
+                logging.info(f"获取到ETF数据，形状: {etf_data.shape}, 列名: {list(etf_data.columns)}")
+                
+                # 检查具体内容
+                if not etf_data.empty:
+                    sample = etf_data.head(3)
+                    logging.info(f"数据样例:\n{sample}")
+                
+                return etf_data.drop_duplicates('代码').set_index('代码')['名称']
+            except Exception as e:
+                if retry < max_retries - 1:
+                    logging.warning(f"第{retry + 1}次获取东方财富ETF列表失败，正在重试...")
+                    time.sleep(2)
+                else:
+                    logging.error(f"从东方财富获取ETF列表失败: {str(e)}", exc_info=True)
+        # 多次失败后缓存空结果，后续查询直接走备用方案
+        return pd.Series(dtype=object)
+    
+    def get_etf_name_from_eastmoney(self, symbol):
+        """从东方财富网获取ETF名称（在缓存的行情快照中查找）"""
+        name = self._spot_names.get(symbol)
+        if name is not None:
+            logging.info(f"从东方财富获取到ETF名称: {name}")
+            return name, True
+        logging.warning(f"在东方财富数据中未找到ETF {symbol}")
+        return None, False
     
     def get_etf_name(self, symbol):
         """获取ETF名称，优先东方财富，失败则使用预定义映射"""
@@ -76,7 +117,7 @@ class ETFNameFetcher:
     def check_table_columns(self):
         """检查etf_list表结构并添加缺少的列"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._get_conn()
             cursor = conn.cursor()
             
             # 检查etf_list表是否存在
@@ -94,7 +135,7 @@ class ETFNameFetcher:
                 ''')
                 logging.info("创建etf_list表成功")
                 conn.commit()
-                conn.close()
+                self._has_updated_at = True
                 return True
             
             # 表存在，检查列
@@ -113,40 +154,52 @@ class ETFNameFetcher:
                 cursor.execute("ALTER TABLE etf_list ADD COLUMN category TEXT")
             
             conn.commit()
-            conn.close()
+            self._has_updated_at = True
             return True
         except Exception as e:
             logging.error(f"检查表结构失败: {str(e)}", exc_info=True)
             return False
     
+    def _save_sql(self):
+        """根据是否存在updated_at列选择插入语句，表结构只查询一次
+
+        已存在的ETF原地更新名称（UPSERT），不会像 INSERT OR REPLACE 那样删除整行重建，
+        其他列和行ID保持不变
+        """
+        if self._has_updated_at is None:
+            cursor = self._get_conn().execute("PRAGMA table_info(etf_list)")
+            self._has_updated_at = 'updated_at' in [column[1] for column in cursor.fetchall()]
+        
+        if self._has_updated_at:
+            # 如果有updated_at列
+            return """
+            INSERT INTO etf_list (symbol, name, updated_at)
+            VALUES (?, ?, datetime('now', 'localtime'))
+            ON CONFLICT(symbol) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at
+            """
+        # 如果没有updated_at列
+        return """
+        INSERT INTO etf_list (symbol, name)
+        VALUES (?, ?)
+        ON CONFLICT(symbol) DO UPDATE SET name = excluded.name
+        """
+    
     def save_etf_to_db(self, symbol, name):
         """将ETF信息保存到数据库"""
+        if self.save_etfs_to_db([(symbol, name)]):
+            logging.info(f"保存ETF {symbol}:{name} 到数据库成功")
+            return True
+        return False
+    
+    def save_etfs_to_db(self, rows):
+        """将多个 (symbol, name) 一次性保存到数据库"""
+        conn = self._get_conn()
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # 检查是否存在updated_at列
-            cursor.execute("PRAGMA table_info(etf_list)")
-            columns = [column[1] for column in cursor.fetchall()]
-            
-            if 'updated_at' in columns:
-                # 如果有updated_at列
-                cursor.execute("""
-                INSERT OR REPLACE INTO etf_list (symbol, name, updated_at)
-                VALUES (?, ?, datetime('now', 'localtime'))
-                """, (symbol, name))
-            else:
-                # 如果没有updated_at列
-                cursor.execute("""
-                INSERT OR REPLACE INTO etf_list (symbol, name)
-                VALUES (?, ?)
-                """, (symbol, name))
-            
+            conn.executemany(self._save_sql(), rows)
             conn.commit()
-            conn.close()
-            logging.info(f"保存ETF {symbol}:{name} 到数据库成功")
             return True
         except Exception as e:
+            conn.rollback()
             logging.error(f"保存ETF到数据库失败: {str(e)}", exc_info=True)
             return False
     
@@ -156,35 +209,37 @@ class ETFNameFetcher:
         if not self.check_table_columns():
             logging.error("检查表结构失败，尝试继续操作")
         
-        # 如果没有提供symbols，尝试获取所有ETF列表
+        # 如果没有提供symbols，使用东方财富行情快照中的所有ETF
         if not symbols:
-            try:
-                logging.info("尝试从东方财富获取所有ETF列表...")
-                etf_data = ak.fund_etf_spot_em()
-                symbols = etf_data['代码'].tolist()
+            symbols = self._spot_names.index.tolist()
+            if symbols:
                 logging.info(f"获取到 {len(symbols)} 个ETF代码")
-            except Exception as e:
-                logging.error(f"获取所有ETF列表失败: {str(e)}", exc_info=True)
+            else:
+                logging.error("获取所有ETF列表失败")
                 # 使用预定义ETF列表
                 symbols = list(self.etf_dict.keys())
                 logging.info(f"使用预定义的 {len(symbols)} 个ETF代码")
         
         success_count = 0
         fail_count = 0
+        rows = []
         
         for symbol in symbols:
             try:
-                name = self.get_etf_name(symbol)
-                if self.save_etf_to_db(symbol, name):
-                    success_count += 1
-                else:
-                    fail_count += 1
-                # 添加延迟，避免请求过快
-                time.sleep(0.2)
+                # 名称来自同一份行情快照，逐个查询不再访问网络
+                rows.append((symbol, self.get_etf_name(symbol)))
             except Exception as e:
                 logging.error(f"处理ETF {symbol} 失败: {str(e)}", exc_info=True)
                 fail_count += 1
         
+        # 所有名称获取完成后一次性写入数据库
+        if rows:
+            if self.save_etfs_to_db(rows):
+                success_count = len(rows)
+                logging.info(f"保存 {len(rows)} 个ETF到数据库成功")
+            else:
+                fail_count += len(rows)
+        
         logging.info(f"ETF获取和保存完成: 成功 {success_count}, 失败 {fail_count}")
         return success_count, fail_count
 
@@ -196,18 +251,21 @@ def main():
     # 创建ETF名称获取器
     fetcher = ETFNameFetcher()
     
-    # 检查命令行参数
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "all":
-            # 获取所有ETF信息
-            fetcher.fetch_and_save_etfs()
+    try:
+        # 检查命令行参数
+        if len(sys.argv) > 1:
+            if sys.argv[1] == "all":
+                # 获取所有ETF信息
+                fetcher.fetch_and_save_etfs()
+            else:
+                # 获取指定ETF信息
+                symbols = sys.argv[1:]
+                fetcher.fetch_and_save_etfs(symbols)
         else:
-            # 获取指定ETF信息
-            symbols = sys.argv[1:]
-            fetcher.fetch_and_save_etfs(symbols)
-    else:
-        # 默认获取所有ETF
-        fetcher.fetch_and_save_etfs()
+            # 默认获取所有ETF
+            fetcher.fetch_and_save_etfs()
+    finally:
+        fetcher.close()
     
     logging.info("ETF名称获取脚本运行完成")
 
@@ -67,27 +67,29 @@ def import_etfs():
         
         # 添加索引
         conn.execute('CREATE INDEX IF NOT EXISTS idx_etf_symbol ON etf_list (symbol)')
+        # 官方ETF列表查询（WHERE is_official = 1 ORDER BY category, name）使用的部分索引
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_etf_list_official ON etf_list (category, name) WHERE is_official = 1')
         
-        # 导入ETF
-        for etf in SYMBOLS:
-            # 从权重中移除百分号并转换为浮点数
-            weight_value = etf["weight"].replace("%", "")
-            
-            # 插入ETF
-            conn.execute('''
-            INSERT INTO etf_list (symbol, name, description, is_official, category, correlation, volatility_type, weight, created_at, last_updated)
-            VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
-            ''', (
-                etf["code"],
-                etf["name"],
-                f"{etf['name']} - {etf['correlation']}",
-                etf["category"],
-                etf["correlation"],
-                etf["volatility_type"],
-                weight_value,
-                current_time,
-                current_time
-            ))
+        # 与应用一致使用WAL日志，批量导入时不必每次写入都等待fsync
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        
+        # 导入ETF（权重中移除百分号），一次 executemany 批量插入
+        rows = [(
+            etf["code"],
+            etf["name"],
+            f"{etf['name']} - {etf['correlation']}",
+            etf["category"],
+            etf["correlation"],
+            etf["volatility_type"],
+            etf["weight"].replace("%", ""),
+            current_time,
+            current_time
+        ) for etf in SYMBOLS]
+        conn.executemany('''
+        INSERT INTO etf_list (symbol, name, description, is_official, category, correlation, volatility_type, weight, created_at, last_updated)
+        VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+        ''', rows)
         
         conn.commit()
         print(f"成功导入 {len(SYMBOLS)} 个ETF到etf_list表")
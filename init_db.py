@@ -22,6 +22,9 @@ def init_db():
             logger.info("已创建database目录")
         
         conn = get_db_connection()
+        # 建库时即切换为WAL日志（持久保存在数据库文件中，之后的连接都会沿用）
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
         cursor = conn.cursor()
         
         # 创建ETF历史数据表
@@ -60,6 +63,8 @@ def init_db():
             last_updated TEXT
         )
         ''')
+        # 官方ETF列表查询（WHERE is_official = 1 ORDER BY category, name）使用的部分索引
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_etf_list_official ON etf_list (category, name) WHERE is_official = 1')
         
         # 创建官方ETF列表
         official_etfs_file = 'data/official_etfs.sql'
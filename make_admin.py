@@ -1,35 +1,31 @@
-import sqlite3
 import sys
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect('database/etf_history.db', timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+from models.db_pool import get_conn
+
+# users 表是否已确认有 is_admin 列，进程内只检查一次
+_HAS_IS_ADMIN = False
+
+def _ensure_schema(conn):
+    """确保users表有is_admin列，缺失时添加；结构只在第一次调用时检查"""
+    global _HAS_IS_ADMIN
+    if _HAS_IS_ADMIN:
+        return
+    columns = conn.execute("PRAGMA table_info(users)").fetchall()
+    if not any(col['name'] == 'is_admin' for col in columns):
+        print("添加is_admin列到users表...")
+        conn.execute('ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0')
+        conn.commit()
+    _HAS_IS_ADMIN = True
 
 def list_users():
     """列出所有用户"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 检查是否有is_admin列
-        cursor.execute("PRAGMA table_info(users)")
-        columns = cursor.fetchall()
-        has_is_admin = any(col['name'] == 'is_admin' for col in columns)
-        print(f"列信息: {[dict(col) for col in columns]}")
-        print(f"是否有is_admin列: {has_is_admin}")
-        
-        # 根据是否有is_admin列执行不同的查询
-        if has_is_admin:
+        with get_conn() as conn:
+            _ensure_schema(conn)
+            cursor = conn.cursor()
             cursor.execute('SELECT id, username, email, is_admin FROM users ORDER BY id')
-        else:
-            cursor.execute('SELECT id, username, email FROM users ORDER BY id')
-        
-        users = cursor.fetchall()
-        print(f"查询到 {len(users)} 个用户")
-        
-        conn.close()
+            users = cursor.fetchall()
+            print(f"查询到 {len(users)} 个用户")
         
         if not users:
             print("当前没有任何用户。")
@@ -51,34 +47,22 @@ def list_users():
 
 def make_admin(user_id):
     """将指定用户升级为管理员"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查是否存在is_admin列
-    cursor.execute("PRAGMA table_info(users)")
-    columns = cursor.fetchall()
-    has_is_admin = any(col['name'] == 'is_admin' for col in columns)
-    
-    # 如果is_admin列不存在，添加该列
-    if not has_is_admin:
-        print("添加is_admin列到users表...")
-        cursor.execute('ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0')
+    with get_conn() as conn:
+        _ensure_schema(conn)
+        cursor = conn.cursor()
+        
+        # 检查用户是否存在
+        cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
+        user = cursor.fetchone()
+        
+        if not user:
+            print(f"错误: 用户ID {user_id} 不存在。")
+            return False
+        
+        # 更新用户为管理员
+        cursor.execute('UPDATE users SET is_admin = 1 WHERE id = ?', (user_id,))
         conn.commit()
     
-    # 检查用户是否存在
-    cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-    user = cursor.fetchone()
-    
-    if not user:
-        conn.close()
-        print(f"错误: 用户ID {user_id} 不存在。")
-        return False
-    
-    # 更新用户为管理员
-    cursor.execute('UPDATE users SET is_admin = 1 WHERE id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-    
     print(f"用户ID {user_id} 已被成功设置为管理员。")
     return True
 
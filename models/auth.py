@@ -1,5 +1,6 @@
-from flask import session, redirect, url_for, request, flash, jsonify
+from flask import session, redirect, url_for, request, flash, jsonify, g
 import functools
+import hmac
 import secrets
 import time
 from .user import User
@@ -16,6 +17,7 @@ def login_required(view):
 def login_user(user_id):
     """将用户登录状态保存到会话"""
     session.clear()
+    g.pop('_current_user', None)
     session['user_id'] = user_id
     session['login_time'] = int(time.time())
     # 生成CSRF令牌
@@ -26,10 +28,14 @@ def login_user(user_id):
 def logout_user():
     """清除用户登录状态"""
     session.clear()
+    g.pop('_current_user', None)
     return True
 
 def get_current_user():
-    """获取当前登录用户信息"""
+    """获取当前登录用户信息，每个请求只查询一次数据库，结果缓存在 flask.g 上"""
+    if '_current_user' in g:
+        return g._current_user
+    user = None
     if 'user_id' in session:
         user = User.get_by_id(session['user_id'])
         # 确保有is_admin属性
@@ -40,35 +46,49 @@ def get_current_user():
             else:
                 # 如果是自定义对象但没有is_admin属性
                 setattr(user, 'is_admin', 0)
-        return user
-    return None
+    g._current_user = user
+    return user
+
+# 需要进行CSRF校验的请求方法
+CSRF_PROTECTED_METHODS = frozenset(('POST', 'PUT', 'DELETE', 'PATCH'))
+
+def validate_csrf_token():
+    """检查当前请求携带的CSRF令牌是否与会话中的一致"""
+    # 从请求中获取CSRF令牌
+    token = None
+    
+    # 从JSON数据中获取，请求体只解析一次
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, dict):
+        token = payload.get('csrf_token')
+        
+    # 从表单数据中获取
+    if not token and request.form:
+        token = request.form.get('csrf_token')
+        
+    # 从请求头中获取
+    if not token:
+        token = request.headers.get('X-CSRF-Token')
+        
+    # 验证令牌，使用恒定时间比较
+    expected = session.get('csrf_token')
+    if not isinstance(token, str) or not token or not expected:
+        return False
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+def csrf_failure_response():
+    """CSRF验证失败时的统一响应"""
+    flash('CSRF验证失败，请刷新页面重试', 'error')
+    if request.is_json:
+        return jsonify({'error': 'CSRF验证失败'}), 403
+    return redirect(request.referrer or url_for('dashboard'))
 
 def check_csrf_token(view):
     """CSRF令牌验证装饰器"""
     @functools.wraps(view)
     def wrapped_view(*args, **kwargs):
-        if request.method in ['POST', 'PUT', 'DELETE', 'PATCH']:
-            # 从请求中获取CSRF令牌
-            token = None
-            
-            # 从JSON数据中获取
-            if request.is_json and request.get_json():
-                token = request.get_json().get('csrf_token')
-                
-            # 从表单数据中获取
-            if not token and request.form:
-                token = request.form.get('csrf_token')
-                
-            # 从请求头中获取
-            if not token:
-                token = request.headers.get('X-CSRF-Token')
-                
-            # 验证令牌
-            if not token or token != session.get('csrf_token'):
-                flash('CSRF验证失败，请刷新页面重试', 'error')
-                if request.is_json:
-                    return jsonify({'error': 'CSRF验证失败'}), 403
-                return redirect(request.referrer or url_for('dashboard'))
+        if request.method in CSRF_PROTECTED_METHODS and not validate_csrf_token():
+            return csrf_failure_response()
                 
         return view(*args, **kwargs)
     return wrapped_view 
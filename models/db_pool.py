@@ -0,0 +1,60 @@
+import os
+import queue
+import sqlite3
+from contextlib import contextmanager
+
+DB_PATH = 'database/etf_history.db'
+# 每个进程最多保留的空闲连接数（gunicorn 每个 worker 2 个线程，留出余量）
+POOL_SIZE = 8
+# 每个连接缓存的预编译语句数；连接被池复用，相同的 SQL 只需解析一次
+CACHED_STATEMENTS = 256
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_wal_enabled = False
+
+def _connect():
+    """新建数据库连接并设置连接级的 PRAGMA"""
+    global _wal_enabled
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    if not _wal_enabled:
+        # WAL模式持久保存在数据库文件中，每个进程只需设置一次
+        conn.execute('PRAGMA journal_mode=WAL')
+        _wal_enabled = True
+    # WAL 下 NORMAL 只在检查点时同步，提交只需追加写 WAL 文件
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-20000')
+    conn.execute('PRAGMA mmap_size=268435456')
+    return conn
+
+def _release(conn):
+    """归还连接：回滚未提交的事务后放回连接池，连接异常或池已满时关闭"""
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        _pool.put_nowait(conn)
+    except (sqlite3.Error, queue.Full):
+        conn.close()
+
+@contextmanager
+def get_conn():
+    """从连接池借用一个数据库连接，with 块结束时自动归还
+
+    连接按需创建，空闲连接最多保留 POOL_SIZE 个，复用时 SQLite 的页缓存也得以保留
+    """
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+def _reset_after_fork():
+    """子进程不能复用父进程打开的连接，fork 后换一个新的空连接池"""
+    global _pool
+    _pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,166 +1,260 @@
-import sqlite3
 import logging
-from datetime import datetime
+import sqlite3
+from datetime import datetime, timezone
+
+from models.db_pool import get_conn
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect('database/etf_history.db', timeout=30)
-    conn.row_factory = sqlite3.Row
-    return conn
+def _utc_now():
+    """当前UTC时间，格式与 SQLite 的 datetime('now') 相同，在 Python 中生成一次作为参数传入"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def iter_all_etfs():
+    """逐行返回所有ETF，不一次性取出整张表；连接在遍历结束或生成器关闭时归还连接池"""
+    with get_conn() as conn:
+        cursor = conn.execute('SELECT * FROM etf_list ORDER BY symbol')
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
 
 def get_all_etfs():
     """获取所有ETF列表"""
-    conn = get_db_connection()
-    etfs = conn.execute('SELECT * FROM etf_list ORDER BY symbol').fetchall()
-    conn.close()
-    return etfs
+    return list(iter_all_etfs())
 
 def get_etf_by_symbol(symbol):
     """根据代码获取ETF信息"""
-    conn = get_db_connection()
-    etf = conn.execute('SELECT * FROM etf_list WHERE symbol = ?', (symbol,)).fetchone()
-    conn.close()
-    return etf
+    with get_conn() as conn:
+        return conn.execute('SELECT * FROM etf_list WHERE symbol = ?', (symbol,)).fetchone()
+
+def etf_exists(symbol):
+    """检查ETF代码是否存在"""
+    with get_conn() as conn:
+        return conn.execute('SELECT 1 FROM etf_list WHERE symbol = ? LIMIT 1', (symbol,)).fetchone() is not None
 
 def add_etf(symbol, name, description, is_official=0, category='', correlation='', volatility_type='', weight=1.0):
     """添加新的ETF"""
-    conn = get_db_connection()
-    try:
-        # 检查ETF是否已存在
-        existing = conn.execute('SELECT 1 FROM etf_list WHERE symbol = ?', (symbol,)).fetchone()
-        if existing:
-            conn.close()
-            return False, "ETF代码已存在"
-        
-        # 添加新ETF
-        conn.execute('''
-            INSERT INTO etf_list 
-            (symbol, name, description, is_official, category, correlation, volatility_type, weight, created_at, last_updated)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now'), datetime('now'))
-        ''', (symbol, name, description, 1 if is_official else 0, category, correlation, volatility_type, weight))
-        conn.commit()
-        conn.close()
-        return True, "ETF添加成功"
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        logger.error(f"添加ETF失败: {str(e)}")
-        return False, f"添加ETF失败: {str(e)}"
-
-def update_etf(symbol, name, description, is_official, category, correlation, volatility_type, weight, new_symbol=None):
-    """更新ETF信息，如果提供new_symbol则同时更改ETF代码"""
-    conn = get_db_connection()
-    try:
-        # 检查是否需要更新symbol
-        if new_symbol and new_symbol != symbol:
-            # 检查新symbol是否已经存在
-            existing = conn.execute('SELECT 1 FROM etf_list WHERE symbol = ?', (new_symbol,)).fetchone()
+    with get_conn() as conn:
+        try:
+            # 检查ETF是否已存在
+            existing = conn.execute('SELECT 1 FROM etf_list WHERE symbol = ?', (symbol,)).fetchone()
             if existing:
-                conn.close()
-                return False, f"ETF代码 {new_symbol} 已存在，无法更新"
+                return False, "ETF代码已存在"
             
-            # 更新ETF基本信息和代码
+            # 添加新ETF
+            now = _utc_now()
             conn.execute('''
-                UPDATE etf_list 
-                SET symbol = ?, name = ?, description = ?, is_official = ?, category = ?, 
-                    correlation = ?, volatility_type = ?, weight = ?, last_updated = datetime('now')
-                WHERE symbol = ?
-            ''', (new_symbol, name, description, 1 if is_official else 0, category, correlation, volatility_type, weight, symbol))
+                INSERT INTO etf_list 
+                (symbol, name, description, is_official, category, correlation, volatility_type, weight, created_at, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (symbol, name, description, int(bool(is_official)), category, correlation, volatility_type, weight, now, now))
+            conn.commit()
+            return True, "ETF添加成功"
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"添加ETF失败: {str(e)}")
+            return False, f"添加ETF失败: {str(e)}"
+
+def add_etfs(rows):
+    """批量添加ETF，rows 为 (symbol, name, description, is_official, category, correlation, volatility_type, weight) 元组
+
+    已存在的代码通过一次 IN 查询找出并跳过，其余在同一个事务里用 executemany 插入。
+    返回 (success, message, skipped)，skipped 为已存在而未添加的代码列表
+    """
+    now = _utc_now()
+    rows = [
+        (symbol, name, description, int(bool(is_official)), category, correlation, volatility_type, weight, now, now)
+        for symbol, name, description, is_official, category, correlation, volatility_type, weight in rows
+    ]
+    symbols = list(dict.fromkeys(row[0] for row in rows))
+    with get_conn() as conn:
+        try:
+            # 分批查询已存在的代码，避免超出 SQLite 的参数数量上限
+            existing = set()
+            for i in range(0, len(symbols), 500):
+                batch = symbols[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                existing.update(row[0] for row in conn.execute(
+                    f'SELECT symbol FROM etf_list WHERE symbol IN ({placeholders})', batch
+                ))
             
-            # 更新相关的历史数据的symbol
-            conn.execute('UPDATE etf_data SET symbol = ? WHERE symbol = ?', (new_symbol, symbol))
+            # 同一批次内重复的代码由唯一约束忽略，只保留第一条
+            conn.executemany('''
+                INSERT OR IGNORE INTO etf_list 
+                (symbol, name, description, is_official, category, correlation, volatility_type, weight, created_at, last_updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [row for row in rows if row[0] not in existing])
+            conn.commit()
+            skipped = [symbol for symbol in symbols if symbol in existing]
+            return True, f"成功添加{len(symbols) - len(skipped)}个ETF", skipped
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"批量添加ETF失败: {str(e)}")
+            return False, f"批量添加ETF失败: {str(e)}", []
+
+def update_etf(symbol, name, description, is_official, category, correlation, volatility_type, weight, new_symbol=None):
+    """更新ETF信息，如果提供new_symbol则同时更改ETF代码"""
+    now = _utc_now()
+    with get_conn() as conn:
+        try:
+            # 先取得写锁：最多三张表的更新在同一个事务里完成，只提交一次
+            conn.execute('BEGIN IMMEDIATE')
             
-            # 更新投资组合中的ETF引用
-            conn.execute('UPDATE portfolio_etfs SET symbol = ? WHERE symbol = ?', (new_symbol, symbol))
-        else:
-            # 只更新基本信息，不更改代码
-            conn.execute('''
-                UPDATE etf_list 
-                SET name = ?, description = ?, is_official = ?, category = ?, 
-                    correlation = ?, volatility_type = ?, weight = ?, last_updated = datetime('now')
-                WHERE symbol = ?
-            ''', (name, description, 1 if is_official else 0, category, correlation, volatility_type, weight, symbol))
-        
-        conn.commit()
-        conn.close()
-        return True, "ETF更新成功"
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        logger.error(f"更新ETF失败: {str(e)}")
-        return False, f"更新ETF失败: {str(e)}"
+            # 检查是否需要更新symbol
+            if new_symbol and new_symbol != symbol:
+                # 更新ETF基本信息和代码；新代码已存在时由 symbol 的唯一约束报错，不再预先查询
+                try:
+                    conn.execute('''
+                        UPDATE etf_list 
+                        SET symbol = ?, name = ?, description = ?, is_official = ?, category = ?, 
+                            correlation = ?, volatility_type = ?, weight = ?, last_updated = ?
+                        WHERE symbol = ?
+                    ''', (new_symbol, name, description, int(bool(is_official)), category, correlation, volatility_type, weight, now, symbol))
+                except sqlite3.IntegrityError as e:
+                    if e.sqlite_errorname != 'SQLITE_CONSTRAINT_UNIQUE':
+                        raise
+                    conn.rollback()
+                    return False, f"ETF代码 {new_symbol} 已存在，无法更新"
+                
+                # 更新相关的历史数据的symbol
+                conn.execute('UPDATE etf_data SET symbol = ? WHERE symbol = ?', (new_symbol, symbol))
+                
+                # 更新投资组合中的ETF引用
+                conn.execute('UPDATE portfolio_etfs SET symbol = ? WHERE symbol = ?', (new_symbol, symbol))
+            else:
+                # 只更新基本信息，不更改代码
+                conn.execute('''
+                    UPDATE etf_list 
+                    SET name = ?, description = ?, is_official = ?, category = ?, 
+                        correlation = ?, volatility_type = ?, weight = ?, last_updated = ?
+                    WHERE symbol = ?
+                ''', (name, description, int(bool(is_official)), category, correlation, volatility_type, weight, now, symbol))
+            
+            conn.commit()
+            return True, "ETF更新成功"
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"更新ETF失败: {str(e)}")
+            return False, f"更新ETF失败: {str(e)}"
 
 def delete_etf(symbol):
     """删除ETF"""
-    conn = get_db_connection()
-    try:
-        # 先检查是否有关联的数据
-        data_count = conn.execute('SELECT COUNT(*) FROM etf_data WHERE symbol = ?', (symbol,)).fetchone()[0]
-        
-        # 删除ETF记录
-        conn.execute('DELETE FROM etf_list WHERE symbol = ?', (symbol,))
-        
-        # 可选：删除相关历史数据
-        if data_count > 0:
-            prompt = f"该ETF有{data_count}条历史数据记录，是否一并删除？"
-        else:
-            prompt = None
+    with get_conn() as conn:
+        try:
+            # 先检查是否有关联的数据
+            data_count = conn.execute('SELECT COUNT(*) FROM etf_data WHERE symbol = ?', (symbol,)).fetchone()[0]
+            
+            # 删除ETF记录
+            conn.execute('DELETE FROM etf_list WHERE symbol = ?', (symbol,))
+            
+            # 可选：删除相关历史数据
+            if data_count > 0:
+                prompt = f"该ETF有{data_count}条历史数据记录，是否一并删除？"
+            else:
+                prompt = None
+                
+            conn.commit()
+            return True, "ETF删除成功", prompt, data_count
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"删除ETF失败: {str(e)}")
+            return False, f"删除ETF失败: {str(e)}", None, 0
+
+def delete_etf_by_id(etf_id):
+    """按ID删除ETF，DELETE ... RETURNING 一条语句完成查找和删除
+
+    返回 (success, message, prompt, data_count)，ETF不存在时 success 为 None
+    """
+    with get_conn() as conn:
+        try:
+            row = conn.execute('DELETE FROM etf_list WHERE id = ? RETURNING symbol', (etf_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None, "ETF不存在", None, 0
+            
+            # 同一事务内统计关联的历史数据
+            data_count = conn.execute('SELECT COUNT(*) FROM etf_data WHERE symbol = ?', (row['symbol'],)).fetchone()[0]
+            if data_count > 0:
+                prompt = f"该ETF有{data_count}条历史数据记录，是否一并删除？"
+            else:
+                prompt = None
             
-        conn.commit()
-        conn.close()
-        return True, "ETF删除成功", prompt, data_count
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        logger.error(f"删除ETF失败: {str(e)}")
-        return False, f"删除ETF失败: {str(e)}", None, 0
+            conn.commit()
+            return True, "ETF删除成功", prompt, data_count
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"删除ETF失败: {str(e)}")
+            return False, f"删除ETF失败: {str(e)}", None, 0
 
 def get_etf_data_count(symbol):
     """获取指定ETF的历史数据记录数量"""
-    conn = get_db_connection()
-    
-    # 从etf_data表中查询数据量
-    count = conn.execute('SELECT COUNT(*) FROM etf_data WHERE symbol = ?', (symbol,)).fetchone()[0]
-    
-    conn.close()
-    return count
+    with get_conn() as conn:
+        # 从etf_data表中查询数据量
+        return conn.execute('SELECT COUNT(*) FROM etf_data WHERE symbol = ?', (symbol,)).fetchone()[0]
+
+def get_etf_data_stats(symbols):
+    """批量获取多个ETF的历史数据记录数量和日期范围
+
+    返回 {symbol: (count, start_date, end_date)}，没有数据的ETF不在结果中。
+    按 idx_etf_data_symbol_date 索引分组统计，不需要逐个ETF查询
+    """
+    symbols = list(dict.fromkeys(symbols))
+    stats = {}
+    with get_conn() as conn:
+        # 分批查询，避免超出 SQLite 的参数数量上限
+        for i in range(0, len(symbols), 500):
+            batch = symbols[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = conn.execute(f'''
+                SELECT symbol, COUNT(*) as data_count, MIN(date) as start_date, MAX(date) as end_date
+                FROM etf_data
+                WHERE symbol IN ({placeholders})
+                GROUP BY symbol
+            ''', batch).fetchall()
+            for row in rows:
+                stats[row['symbol']] = (row['data_count'], row['start_date'], row['end_date'])
+    return stats
 
 def get_etf_date_range(symbol):
     """获取指定ETF的数据日期范围"""
-    conn = get_db_connection()
-    result = conn.execute('''
-        SELECT MIN(date) as start_date, MAX(date) as end_date 
-        FROM etf_data 
-        WHERE symbol = ?
-    ''', (symbol,)).fetchone()
-    conn.close()
+    with get_conn() as conn:
+        result = conn.execute('''
+            SELECT MIN(date) as start_date, MAX(date) as end_date 
+            FROM etf_data 
+            WHERE symbol = ?
+        ''', (symbol,)).fetchone()
     
     if result and result['start_date'] and result['end_date']:
         return result['start_date'], result['end_date']
     return None, None
 
-def clear_etf_data(symbol=None):
-    """清除ETF历史数据"""
-    conn = get_db_connection()
-    try:
-        if symbol:
-            # 清除指定ETF的数据
-            conn.execute('DELETE FROM etf_data WHERE symbol = ?', (symbol,))
-            message = f"已清除{symbol}的所有历史数据"
-        else:
-            # 清除所有ETF数据
-            conn.execute('DELETE FROM etf_data')
-            message = "已清除所有ETF的历史数据"
+def clear_etf_data(symbol=None, vacuum=False):
+    """清除ETF历史数据，vacuum 为 True 时随后执行 VACUUM，把释放的页归还给文件系统"""
+    with get_conn() as conn:
+        try:
+            if symbol:
+                # 清除指定ETF的数据，按 idx_etf_data_symbol_date 索引只访问该ETF的行
+                conn.execute('DELETE FROM etf_data WHERE symbol = ?', (symbol,))
+                message = f"已清除{symbol}的所有历史数据"
+            else:
+                # 清除所有ETF数据：不带 WHERE 且表上没有触发器，SQLite 直接截断整表而不逐行删除
+                conn.execute('DELETE FROM etf_data')
+                message = "已清除所有ETF的历史数据"
+            
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"清除ETF数据失败: {str(e)}")
+            return False, f"清除ETF数据失败: {str(e)}"
         
-        conn.commit()
-        conn.close()
-        return True, message
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        logger.error(f"清除ETF数据失败: {str(e)}")
-        return False, f"清除ETF数据失败: {str(e)}" 
\ No newline at end of file
+        if vacuum:
+            # VACUUM 不能在事务中执行，提交后再做；失败时数据已删除，只是文件未收缩
+            try:
+                conn.execute('VACUUM')
+            except Exception as e:
+                logger.error(f"VACUUM 失败: {str(e)}")
+                message += f"（VACUUM 未完成: {str(e)}）"
+        return True, message
\ No newline at end of file
@@ -1,9 +1,14 @@
 import logging
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from dateutil.relativedelta import relativedelta
+
 import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 import akshare as ak
 import yfinance as yf
 import warnings
@@ -12,27 +17,66 @@ import warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
+# 年化系数（一年252个交易日）
+_ANNUALIZATION = math.sqrt(252)
 
-def safe_product(arr):
-    """修复 quantstats 中的问题"""
-    return np.prod(arr)
+# ETF参数缓存：symbol -> (版本号, 时间桶, 结果)，数据刷新时调用 invalidate_etf_params_cache
+_PARAMS_CACHE = {}
+_PARAMS_CACHE_TTL = 300
+_PARAMS_CACHE_MAX = 512
+_params_version = 0
 
+# 行情数据缓存：(symbol, end_date) -> (版本号, 获取时间, DataFrame)，同一请求内多次取同一ETF不再重复走网络
+_DATA_CACHE = {}
+_DATA_CACHE_TTL = 600
+_DATA_CACHE_MAX = 128
 
-from quantstats.stats import _np
 
-_np.product = safe_product
+def _evict_oldest(cache):
+    """淘汰缓存中最早写入的一项；多个线程同时淘汰或缓存刚被清空时不抛异常"""
+    oldest = next(iter(cache), None)
+    if oldest is not None:
+        cache.pop(oldest, None)
 
 
 def get_etf_data(symbol, end_date=None):
+    """获取ETF/LOF数据，10分钟内相同 (symbol, end_date) 直接返回缓存数据的副本"""
+    if end_date is None:
+        end_date = datetime.now().strftime("%Y%m%d")
+    key = (symbol, end_date)
+    now = time.time()
+    cached = _DATA_CACHE.get(key)
+    if cached is not None and cached[0] == _params_version and now - cached[1] < _DATA_CACHE_TTL:
+        return cached[2].copy(), symbol
+
+    version = _params_version
+    df, symbol = _fetch_etf_data(symbol, end_date)
+    if len(_DATA_CACHE) >= _DATA_CACHE_MAX and key not in _DATA_CACHE:
+        _evict_oldest(_DATA_CACHE)
+    _DATA_CACHE[key] = (version, now, df)
+    return df.copy(), symbol
+
+
+def get_etf_data_bulk(symbols, max_workers=8):
+    """并发获取多个ETF的数据，返回 {symbol: DataFrame}
+
+    获取数据主要在等待网络，用线程池并行请求；重复的代码只获取一次，任一ETF获取失败时抛出异常
+    """
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(symbols))) as executor:
+        results = executor.map(get_etf_data, symbols)
+        return {symbol: df for symbol, (df, _) in zip(symbols, results)}
+
+
+def _fetch_etf_data(symbol, end_date):
     """获取ETF/LOF数据，优先使用 AkShare，失败则回退到 yfinance"""
     logger = logging.getLogger(__name__)
 
     max_retries = 3
-    if end_date is None:
-        end_date = datetime.now().strftime("%Y%m%d")
-    start_date = (
-        datetime.now().replace(year=datetime.now().year - 5).strftime("%Y%m%d")
-    )
+    # 用 relativedelta 回溯5年，2月29日时不会因目标年份没有该日期而报错
+    start_date = (datetime.now() - relativedelta(years=5)).strftime("%Y%m%d")
 
     for retry in range(max_retries):
         try:
@@ -44,9 +88,14 @@ def get_etf_data(symbol, end_date=None):
                 adjust="qfq",
             )
             df = df.rename(columns={"日期": "date", "收盘": "close"})
-            df["date"] = pd.to_datetime(df["date"])
+            # 日期固定为 YYYY-MM-DD，显式指定格式以跳过逐行的格式推断
+            df["date"] = pd.to_datetime(df["date"], format="%Y-%m-%d")
             df.set_index("date", inplace=True)
-            df.sort_index(inplace=True)
+            # AkShare 返回的数据已按日期升序，只有乱序时才排序
+            if not df.index.is_monotonic_increasing:
+                df.sort_index(inplace=True)
+            # 下游只用到收盘价，只保留 close 列以减少内存占用和复制开销
+            df = df[["close"]].astype(np.float64)
 
             data_days = len(df)
             logger.info(
@@ -59,7 +108,8 @@ def get_etf_data(symbol, end_date=None):
         except Exception as e:
             if retry < max_retries - 1:
                 print(f"第{retry + 1}次获取数据失败，正在重试...")
-                time.sleep(5)
+                # 指数退避：1秒、2秒……
+                time.sleep(2 ** retry)
             else:
                 logger.warning(f"AkShare 获取失败，尝试使用 yfinance: {e}")
                 try:
@@ -83,6 +133,7 @@ def get_etf_data(symbol, end_date=None):
                     df["date"] = pd.to_datetime(df["date"])
                     df.set_index("date", inplace=True)
                     df.sort_index(inplace=True)
+                    df = df[["close"]].astype(np.float64)
                     data_days = len(df)
                     logger.info(
                         f"使用 yfinance 获取ETF {symbol} 数据: {data_days}天, 从 {df.index.min()} 到 {df.index.max()}"
@@ -93,81 +144,217 @@ def get_etf_data(symbol, end_date=None):
                     raise
 
 
-def calculate_volatility(symbol, window=200):
-    """200 日波动率"""
-    df, _ = get_etf_data(symbol)
-    daily_returns = df["close"].pct_change()
-    rolling_std = daily_returns.rolling(window=window).std()
-    annual_vol = rolling_std * np.sqrt(252)
-    return annual_vol
+def _rolling_apply(values, window, func):
+    """在 numpy 数组上计算滚动窗口统计量，结果与输入等长，前 window-1 个位置为 NaN"""
+    out = np.full(len(values), np.nan)
+    if 0 < window <= len(values):
+        out[window - 1:] = func(sliding_window_view(values, window), axis=1)
+    return out
+
+
+def _rolling_std(values, window):
+    """O(N) 滚动样本标准差，窗口内有缺失值时结果为 NaN（与 pandas rolling(window).std() 一致）
+
+    用累加和与平方累加和在一次扫描中得到每个窗口的方差，先减去整体均值避免大数相减损失精度
+    """
+    result = np.full(len(values), np.nan)
+    if window < 2 or len(values) < window:
+        return result
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return result
+    centered = np.where(valid, values - values[valid].mean(), 0.0)
+    s1 = np.concatenate(([0.0], np.cumsum(centered)))
+    s2 = np.concatenate(([0.0], np.cumsum(centered * centered)))
+    count = np.concatenate(([0], np.cumsum(valid)))
+    win_s1 = s1[window:] - s1[:-window]
+    win_s2 = s2[window:] - s2[:-window]
+    full = (count[window:] - count[:-window]) == window
+    var = np.maximum(win_s2 - win_s1 * win_s1 / window, 0.0) / (window - 1)
+    result[window - 1:] = np.where(full, np.sqrt(var), np.nan)
+    return result
+
+
+def _rolling_max_min(values, short_window, long_window):
+    """同时计算短期和长期窗口的滚动最大/最小值
+
+    短窗口结果用 sliding_window_view 对每个窗口求最大/最小值，复杂度 O(N·short_window)；
+    长窗口结果由若干个首尾相接的短窗口结果合并得到，复杂度 O(N·long_window/short_window)，
+    不再对原始序列做长窗口扫描
+    """
+    n = len(values)
+    nan = np.full(n, np.nan)
+    if not 0 < short_window <= n:
+        return nan, nan.copy(), nan.copy(), nan.copy()
+
+    windows = sliding_window_view(values, short_window)
+    high_short = nan.copy()
+    low_short = nan.copy()
+    high_short[short_window - 1:] = windows.max(axis=1)
+    low_short[short_window - 1:] = windows.min(axis=1)
+
+    high_long = nan.copy()
+    low_long = nan.copy()
+    if short_window <= long_window <= n:
+        # 以短窗口结束位置的偏移覆盖 [i-long_window+1, i]，最后一段允许重叠
+        offsets = list(range(0, long_window - short_window + 1, short_window))
+        if offsets[-1] != long_window - short_window:
+            offsets.append(long_window - short_window)
+        end = n - long_window + 1
+        start = long_window - 1
+        high_long[start:] = np.maximum.reduce([high_short[start - off:start - off + end] for off in offsets])
+        low_long[start:] = np.minimum.reduce([low_short[start - off:start - off + end] for off in offsets])
+    elif 0 < long_window <= n:
+        high_long = _rolling_apply(values, long_window, np.max)
+        low_long = _rolling_apply(values, long_window, np.min)
+
+    return high_short, low_short, high_long, low_long
+
+
+def calculate_volatility(symbol, window=200, df=None):
+    """200 日波动率，已获取过数据时可通过 df 传入以避免重复获取"""
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    # 与 pct_change 一致：缺失价格沿用前值，首日收益率为 NaN
+    closes = df["close"].ffill().to_numpy(dtype=np.float64)
+    daily_returns = np.full(len(closes), np.nan)
+    np.divide(closes[1:], closes[:-1], out=daily_returns[1:])
+    daily_returns[1:] -= 1.0
+    annual_vol = _rolling_std(daily_returns, window)
+    annual_vol *= _ANNUALIZATION
+    return pd.Series(annual_vol, index=df.index, name="close")
+
 
+def calculate_volatility_latest(symbol, window=200, df=None):
+    """只计算最新一天的年化波动率，只用到最后 window+1 个收盘价"""
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    closes = df["close"].to_numpy(dtype=np.float64)[-(window + 1):]
+    if len(closes) < window + 1 or np.isnan(closes).any():
+        # 数据不足或有缺失价格时按完整序列计算，保持与 calculate_volatility 一致
+        return float(calculate_volatility(symbol, window, df=df).iloc[-1])
+    daily_returns = closes[1:] / closes[:-1]
+    daily_returns -= 1.0
+    return float(np.std(daily_returns, ddof=1) * _ANNUALIZATION)
 
-def calculate_grid_spacing(symbol, window=200):
-    """计算网格间隔"""
-    volatility = calculate_volatility(symbol, window)
+
+def calculate_grid_spacing(symbol, window=200, df=None, volatility=None):
+    """计算网格间隔，可直接传入已算好的波动率序列或数据 df"""
+    if volatility is None:
+        volatility = calculate_volatility(symbol, window, df=df)
     grid_spacing = volatility / 8
     return grid_spacing
 
 
-def calculate_grid_range(symbol):
+def _grid_range_windows(data_days):
+    """根据数据天数确定网格区间的短期和长期窗口"""
+    if data_days < 500:
+        return min(100, int(data_days * 0.3)), min(300, int(data_days * 0.8))
+    return 100, 500
+
+
+def calculate_grid_range(symbol, df=None):
     """计算网格总区间"""
     logger = logging.getLogger(__name__)
 
-    df, _ = get_etf_data(symbol)
+    if df is None:
+        df, _ = get_etf_data(symbol)
     close = df["close"]
 
     data_days = len(df)
     logger.info(f"计算 {symbol} 网格范围，共有 {data_days} 天数据")
     print(f"计算 {symbol} 网格范围，共有 {data_days} 天数据")
 
+    high_window, high_long_window = _grid_range_windows(data_days)
     if data_days < 500:
-        high_window = min(100, int(data_days * 0.3))
-        low_window = high_window
-        high_long_window = min(300, int(data_days * 0.8))
-        low_long_window = high_long_window
         logger.info(
             f"数据量较少，调整窗口: 短期={high_window}, 长期={high_long_window}"
         )
         print(
             f"数据量较少，调整窗口: 短期={high_window}, 长期={high_long_window}"
         )
-    else:
-        high_window = low_window = 100
-        high_long_window = low_long_window = 500
 
-    high_100 = close.rolling(window=high_window).max()
-    low_100 = close.rolling(window=low_window).min()
-    high_500 = close.rolling(window=high_long_window).max()
-    low_500 = close.rolling(window=low_long_window).min()
+    high_100, low_100, high_500, low_500 = _rolling_max_min(
+        close.to_numpy(dtype=np.float64), high_window, high_long_window
+    )
 
-    H = 0.7 * high_100 + 0.3 * high_500
-    L = 0.7 * low_100 + 0.3 * low_500
+    # 直接复用滚动结果的缓冲区计算上下限，不再分配临时数组
+    np.multiply(high_100, 0.7, out=high_100)
+    high_100 += np.multiply(high_500, 0.3, out=high_500)
+    np.multiply(low_100, 0.7, out=low_100)
+    low_100 += np.multiply(low_500, 0.3, out=low_500)
+    H, L = high_100, low_100
 
-    latest_date = df.index[-1]
-    if pd.isna(H.loc[latest_date]) or pd.isna(L.loc[latest_date]):
+    # 最新一天的结果缺失时直接在 numpy 数组上回退，不经过 .loc 索引
+    if np.isnan(H[-1]) or np.isnan(L[-1]):
         logger.warning(f"{symbol} 网格计算结果有NaN值，尝试使用最新可用数据")
         print(f"{symbol} 网格计算结果有NaN值，尝试使用最新可用数据")
-        last_valid_H = H.last_valid_index()
-        last_valid_L = L.last_valid_index()
-        if last_valid_H is not None and last_valid_L is not None:
-            H.loc[latest_date] = H.loc[last_valid_H]
-            L.loc[latest_date] = L.loc[last_valid_L]
-            logger.info(
-                f"使用最后有效值: H={H.loc[latest_date]}, L={L.loc[latest_date]}"
-            )
-            print(
-                f"使用最后有效值: H={H.loc[latest_date]}, L={L.loc[latest_date]}"
-            )
+        valid_H = np.flatnonzero(~np.isnan(H))
+        valid_L = np.flatnonzero(~np.isnan(L))
+        if valid_H.size and valid_L.size:
+            H[-1] = H[valid_H[-1]]
+            L[-1] = L[valid_L[-1]]
+            logger.info(f"使用最后有效值: H={H[-1]}, L={L[-1]}")
+            print(f"使用最后有效值: H={H[-1]}, L={L[-1]}")
         else:
-            latest_price = close.iloc[-1]
-            H.loc[latest_date] = latest_price * 1.2
-            L.loc[latest_date] = latest_price * 0.8
-            logger.info(
-                f"使用简单估计: H={H.loc[latest_date]}, L={L.loc[latest_date]}"
-            )
-            print(
-                f"使用简单估计: H={H.loc[latest_date]}, L={L.loc[latest_date]}"
-            )
+            latest_price = close.iat[-1]
+            H[-1] = latest_price * 1.2
+            L[-1] = latest_price * 0.8
+            logger.info(f"使用简单估计: H={H[-1]}, L={L[-1]}")
+            print(f"使用简单估计: H={H[-1]}, L={L[-1]}")
 
     return pd.DataFrame({"H_val": H, "L_val": L}, index=df.index)
 
+
+def calculate_grid_range_latest(symbol, df=None):
+    """只计算最新一天的网格上下限，返回 (上限, 下限)"""
+    if df is None:
+        df, _ = get_etf_data(symbol)
+    values = df["close"].to_numpy(dtype=np.float64)
+    short_window, long_window = _grid_range_windows(len(values))
+    if 0 < short_window <= long_window <= len(values):
+        short_tail = values[-short_window:]
+        long_tail = values[-long_window:]
+        upper = 0.7 * short_tail.max() + 0.3 * long_tail.max()
+        lower = 0.7 * short_tail.min() + 0.3 * long_tail.min()
+        if not (np.isnan(upper) or np.isnan(lower)):
+            return float(upper), float(lower)
+    # 窗口不足或有缺失价格时按完整序列计算，沿用其中的回退逻辑
+    latest = calculate_grid_range(symbol, df=df).iloc[-1]
+    return float(latest["H_val"]), float(latest["L_val"])
+
+
+def get_etf_params_bundle(symbol):
+    """一次性计算最新的波动率、网格间隔和网格上下限，并按5分钟时间桶缓存
+
+    返回的字典为缓存共享对象，调用方不要修改
+    """
+    bucket = int(time.time() // _PARAMS_CACHE_TTL)
+    cached = _PARAMS_CACHE.get(symbol)
+    if cached is not None and cached[0] == _params_version and cached[1] == bucket:
+        return cached[2]
+
+    version = _params_version
+    df, _ = get_etf_data(symbol)
+    volatility = calculate_volatility_latest(symbol, df=df)
+    upper_limit, lower_limit = calculate_grid_range_latest(symbol, df=df)
+    bundle = {
+        "volatility": volatility,
+        "grid_spacing": volatility / 8,
+        "upper_limit": upper_limit,
+        "lower_limit": lower_limit,
+    }
+
+    if len(_PARAMS_CACHE) >= _PARAMS_CACHE_MAX and symbol not in _PARAMS_CACHE:
+        _evict_oldest(_PARAMS_CACHE)
+    _PARAMS_CACHE[symbol] = (version, bucket, bundle)
+    return bundle
+
+
+def invalidate_etf_params_cache():
+    """ETF数据刷新后调用，使已缓存的参数和行情数据全部失效"""
+    global _params_version
+    _params_version += 1
+    _PARAMS_CACHE.clear()
+    _DATA_CACHE.clear()
+
@@ -4,16 +4,35 @@ This script evaluates multiple ETF portfolios by optimizing asset weights on
 rolling training windows and comparing them via cross-validated Sharpe ratios.
 The final portfolio is chosen based on validation performance and then
 evaluated on a hold-out test segment to guard against overfitting.
+
+Run the example with ``python -m portfolio_optimizer`` (or ``pypy3 -m
+portfolio_optimizer``). The evolutionary loop itself only touches plain
+NumPy arrays; pandas is confined to data loading and fold slicing.
 """
 from __future__ import annotations
 
+import hashlib
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from typing import Iterable, List, Sequence
 
 import numpy as np
 import pandas as pd
 
-from models.etf_data import get_etf_data
+from models.etf_data import get_etf_data, get_etf_data_bulk
+
+# Annualisation factor for daily returns (252 trading days).
+_ANNUALIZATION = math.sqrt(252)
+
+# Generations for EA runs warm-started from the previous fold's winner.
+WARM_START_GENERATIONS = 42
+
+# Memoised EA results keyed by training data, seed and warm start; see
+# _optimize_fold.
+_EA_CACHE: dict = {}
+_EA_CACHE_MAX = 256
 
 @dataclass
 class BacktestResult:
@@ -26,13 +45,21 @@ class BacktestResult:
     validation_sharpe: float
 
 
-def fetch_prices(symbols: Iterable[str]) -> pd.DataFrame:
-    """Fetch and align closing prices for a list of ETF symbols."""
-    frames = []
+def fetch_prices(symbols: Iterable[str], closes: dict | None = None) -> pd.DataFrame:
+    """Fetch and align closing prices for a list of ETF symbols.
+
+    ``closes`` may hold already fetched close series keyed by symbol; only
+    symbols missing from it are downloaded.
+    """
+    series = {}
     for symbol in symbols:
-        df, _ = get_etf_data(symbol)
-        frames.append(df["close"].rename(symbol))
-    prices = pd.concat(frames, axis=1).dropna()
+        if closes is not None and symbol in closes:
+            series[symbol] = closes[symbol]
+        else:
+            df, _ = get_etf_data(symbol)
+            series[symbol] = df["close"]
+    # A dict of Series aligns on the union of dates in one step
+    prices = pd.DataFrame(series).dropna()
     return prices
 
 
@@ -43,65 +70,157 @@ def sharpe_ratio(weights: np.ndarray, returns: pd.DataFrame) -> float:
     std = portfolio_returns.std()
     if std == 0:
         return 0.0
-    return float(mean / std * np.sqrt(252))
+    return float(mean / std * _ANNUALIZATION)
+
+
+def population_sharpe(population: np.ndarray, returns: np.ndarray) -> np.ndarray:
+    """Compute annualised Sharpe ratios for every individual at once.
+
+    Parameters
+    ----------
+    population:
+        ``(P, N)`` array of weight vectors.
+    returns:
+        ``(T, N)`` array of asset returns. The product is computed in the
+        dtype of ``returns``; mean and std always accumulate in float64.
+
+    Returns
+    -------
+    np.ndarray
+        ``(P,)`` Sharpe ratios; individuals with zero volatility score 0.
+    """
+    portfolio_returns = returns @ population.T.astype(returns.dtype, copy=False)
+    mean = portfolio_returns.mean(axis=0, dtype=np.float64)
+    std = portfolio_returns.std(axis=0, ddof=1, dtype=np.float64)
+    safe_std = np.where(std == 0, 1.0, std)
+    return np.where(std == 0, 0.0, mean / safe_std * _ANNUALIZATION)
 
 
 def evolutionary_optimize(
-    returns: pd.DataFrame,
+    returns: pd.DataFrame | np.ndarray,
     population_size: int = 40,
     generations: int = 60,
     mutation_rate: float = 0.1,
     rng: np.random.Generator | None = None,
+    init_pop: np.ndarray | None = None,
 ) -> np.ndarray:
     """Optimise asset weights using a simple evolutionary algorithm.
 
     Parameters
     ----------
     returns:
-        Historical return series used to evaluate fitness.
+        Historical return series used to evaluate fitness, either a
+        DataFrame or a ``(T, N)`` array; a float32 array is used as is.
     population_size, generations, mutation_rate:
         Standard evolutionary algorithm hyper-parameters.
     rng:
         Optional random number generator for reproducible results.
+    init_pop:
+        Optional weight vectors (one per row) seeded into the initial
+        population, e.g. the winner of a previous run; the remaining
+        individuals are drawn at random.
     """
     rng = rng or np.random.default_rng()
     n_assets = returns.shape[1]
+    # Convert once; fitness for the whole population is one matrix product.
+    # float32 halves the bytes moved per product; fitness only ranks
+    # individuals, and Sharpe ratios agree with float64 to ~1e-6.
+    returns_arr = np.asarray(returns, dtype=np.float32)
 
-    def random_weights() -> np.ndarray:
-        w = rng.random(n_assets)
-        return w / w.sum()
+    # Draw the whole initial population at once, in the same dtype as the
+    # returns so the fitness product needs no conversion
+    population = rng.random((population_size, n_assets), dtype=np.float32)
+    if init_pop is not None:
+        seeds = np.atleast_2d(init_pop)[:population_size]
+        population[: len(seeds)] = seeds
+    population /= population.sum(axis=1, keepdims=True)
 
-    population = np.array([random_weights() for _ in range(population_size)])
+    n_parents = population_size - population_size // 2
+    n_children = population_size - n_parents
+    # Scratch buffers reused every generation; together with the population
+    # buffer the loop allocates no (P, N) arrays
+    parents = np.empty((n_parents, n_assets), dtype=np.float32)
+    children = np.empty((n_children, n_assets), dtype=np.float32)
+    donors = np.empty_like(children)
 
+    best: np.ndarray | None = None
+    best_score = -np.inf
     for _ in range(generations):
-        fitness = np.array([sharpe_ratio(ind, returns) for ind in population])
-        # Select top half of population
-        selected_idx = np.argsort(fitness)[-population_size // 2 :]
-        parents = population[selected_idx]
-
-        # Create offspring via crossover and mutation
-        children = []
-        while len(children) < population_size - len(parents):
-            p1, p2 = parents[rng.integers(len(parents), size=2)]
-            mask = rng.random(n_assets) < 0.5
-            child = np.where(mask, p1, p2)
-            if rng.random() < mutation_rate:
-                mutate_idx = rng.integers(n_assets)
-                child[mutate_idx] = rng.random()
-            child = child / child.sum()
-            children.append(child)
-        population = np.vstack((parents, children))
-
-    # Return the individual with highest fitness
-    fitness = np.array([sharpe_ratio(ind, returns) for ind in population])
-    best_idx = fitness.argmax()
-    return population[best_idx]
+        fitness = population_sharpe(population, returns_arr)
+        gen_best = fitness.argmax()
+        if fitness[gen_best] > best_score:
+            best_score = fitness[gen_best]
+            best = population[gen_best].copy()
+        # Select top half of population; their order does not matter, so a
+        # partition is enough
+        selected_idx = np.argpartition(fitness, n_children)[n_children:]
+        np.take(population, selected_idx, axis=0, out=parents)
+
+        # Create all offspring at once via uniform crossover and point mutation
+        pairs = rng.integers(n_parents, size=(n_children, 2))
+        mask = rng.random((n_children, n_assets)) < 0.5
+        np.take(parents, pairs[:, 1], axis=0, out=children)
+        np.take(parents, pairs[:, 0], axis=0, out=donors)
+        np.copyto(children, donors, where=mask)
+        mutated = np.flatnonzero(rng.random(n_children) < mutation_rate)
+        children[mutated, rng.integers(n_assets, size=mutated.size)] = rng.random(mutated.size)
+        children /= children.sum(axis=1, keepdims=True)
+        # Write the next generation back into the population buffer
+        population[:n_parents] = parents
+        population[n_parents:] = children
+
+    # Return the individual with highest fitness. Parents were scored in the
+    # loop, so only the last generation's offspring still need evaluating.
+    fresh = population[n_parents:] if best is not None else population
+    if len(fresh):
+        fitness = population_sharpe(fresh, returns_arr)
+        if best is None or fitness.max() > best_score:
+            best = fresh[fitness.argmax()]
+    best = best.astype(np.float64)
+    return best / best.sum()
+
+
+def _optimize_fold(
+    train: pd.DataFrame,
+    seed_seq: np.random.SeedSequence,
+    init_pop: np.ndarray | None = None,
+    generations: int = 60,
+) -> np.ndarray:
+    """Run :func:`evolutionary_optimize` for one fold, memoised.
+
+    Each fold gets its own seed, so the result depends only on the training
+    window, the seed and the warm start, and re-running the same portfolio
+    returns the cached weights. The EA receives a plain float32 array, so no
+    pandas objects cross into the optimisation loop.
+    """
+    train_arr = train.to_numpy(dtype=np.float64)
+    key = (
+        train.shape,
+        hashlib.sha1(train_arr.tobytes()).hexdigest(),
+        seed_seq.entropy,
+        seed_seq.spawn_key,
+        generations,
+        None if init_pop is None else init_pop.tobytes(),
+    )
+    weights = _EA_CACHE.get(key)
+    if weights is None:
+        weights = evolutionary_optimize(
+            train_arr.astype(np.float32),
+            generations=generations,
+            rng=np.random.default_rng(seed_seq),
+            init_pop=init_pop,
+        )
+        if len(_EA_CACHE) >= _EA_CACHE_MAX:
+            _EA_CACHE.pop(next(iter(_EA_CACHE)))
+        _EA_CACHE[key] = weights
+    return weights.copy()
 
 
 def backtest_portfolio(
     symbols: Sequence[str],
     n_splits: int = 3,
     seed: int | None = 42,
+    prices: pd.DataFrame | None = None,
 ) -> BacktestResult:
     """Backtest a portfolio using walk-forward cross-validation.
 
@@ -113,27 +232,44 @@ def backtest_portfolio(
         Number of cross-validation folds. The data is divided into
         ``n_splits + 1`` chronological segments; the last segment is kept as
         an untouched test set.
+    prices:
+        Optional pre-aligned closing prices; fetched when omitted.
     """
 
-    prices = fetch_prices(symbols)
+    if prices is None:
+        prices = fetch_prices(symbols)
     returns = prices.pct_change().dropna()
-    rng = np.random.default_rng(seed)
+    # Independent, reproducible random streams: one per fold plus the final run
+    fold_seeds = np.random.SeedSequence(seed).spawn(n_splits + 1)
 
     # Determine fold size for walk-forward validation
     fold_size = len(returns) // (n_splits + 1)
     val_scores: List[float] = []
 
-    # Perform walk-forward cross-validation
+    # Perform walk-forward cross-validation. Each fold's training window
+    # extends the previous one, so later runs are warm-started from the
+    # previous winner and need fewer generations.
+    weights = None
     for i in range(n_splits):
         train = returns.iloc[: fold_size * (i + 1)]
         val = returns.iloc[fold_size * (i + 1) : fold_size * (i + 2)]
-        weights = evolutionary_optimize(train, rng=rng)
+        if weights is None:
+            weights = _optimize_fold(train, fold_seeds[i])
+        else:
+            weights = _optimize_fold(
+                train, fold_seeds[i], init_pop=weights, generations=WARM_START_GENERATIONS
+            )
         val_scores.append(sharpe_ratio(weights, val))
 
     # Train on all data except the final segment and evaluate on the hold-out
     train = returns.iloc[: fold_size * n_splits]
     test = returns.iloc[fold_size * n_splits :]
-    weights = evolutionary_optimize(train, rng=rng)
+    if weights is None:
+        weights = _optimize_fold(train, fold_seeds[n_splits])
+    else:
+        weights = _optimize_fold(
+            train, fold_seeds[n_splits], init_pop=weights, generations=WARM_START_GENERATIONS
+        )
     train_score = sharpe_ratio(weights, train)
     test_score = sharpe_ratio(weights, test)
 
@@ -146,17 +282,37 @@ def backtest_portfolio(
     )
 
 
+def _backtest_task(args) -> BacktestResult:
+    """Worker entry point for :func:`optimize_portfolios`."""
+    symbols, prices, n_splits, seed = args
+    return backtest_portfolio(symbols, n_splits=n_splits, seed=seed, prices=prices)
+
+
 def optimize_portfolios(
     portfolios: Iterable[Sequence[str]],
     n_splits: int = 3,
     seed: int | None = 42,
+    max_workers: int | None = None,
 ) -> BacktestResult:
     """Evaluate multiple portfolios and return the best one.
 
     Portfolios are compared using the cross-validated Sharpe ratio to reduce
-    the risk of overfitting to any particular sample.
+    the risk of overfitting to any particular sample. Prices are fetched once
+    per distinct symbol, concurrently, in the parent process; the CPU-bound
+    optimisation of each portfolio then runs in a process pool
+    (``max_workers=1`` runs serially).
     """
-    results = [backtest_portfolio(p, n_splits=n_splits, seed=seed) for p in portfolios]
+    portfolios = [list(p) for p in portfolios]
+    frames = get_etf_data_bulk(s for p in portfolios for s in p)
+    closes = {symbol: df["close"] for symbol, df in frames.items()}
+    tasks = [(p, fetch_prices(p, closes), n_splits, seed) for p in portfolios]
+
+    workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        results = [_backtest_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_backtest_task, tasks))
     return max(results, key=lambda r: r.validation_sharpe)
 
 
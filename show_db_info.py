@@ -1,10 +1,88 @@
 import sqlite3
 import os
+import sys
+from contextlib import contextmanager
+
+import pandas as pd
+
+_conn = None
+
+# 每个表都相同的表头和分隔线，导入时生成一次
+_SEP_80 = "-" * 80
+_EQ_80 = "=" * 80
+_SEP_120 = "-" * 120
+_COLUMNS_HEADER = f"{'ID':<3} | {'列名':<20} | {'类型':<12} | {'可空':<4} | {'默认值':<15} | {'主键'}"
 
 def get_db_path():
     return 'database/etf_history.db'
 
-def show_database_info():
+def format_columns(columns):
+    """把 PRAGMA table_info 的结果格式化为表结构的各行文本"""
+    lines = [_SEP_80, _COLUMNS_HEADER, _SEP_80]
+    for col in columns:
+        lines.append(f"{col['cid']:<3} | {col['name']:<20} | {col['type']:<12} | {'否' if col['notnull'] else '是':<4} | "
+                     f"{str(col['dflt_value'] or ''):<15} | {'是' if col['pk'] else '否'}")
+    return lines
+
+def _quote_ident(name):
+    """把表名转成带双引号的 SQL 标识符，PRAGMA 和表名不能用参数绑定"""
+    return '"' + name.replace('"', '""') + '"'
+
+def _open_conn():
+    """返回进程内共用的数据库连接，首次调用时创建，之后各查询复用同一连接和页缓存"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(get_db_path())
+        _conn.row_factory = sqlite3.Row
+        # 与应用连接池一致使用 WAL，并加大页缓存、启用内存映射
+        _conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA cache_size=-64000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        """)
+    return _conn
+
+@contextmanager
+def _read_transaction(conn):
+    """显式开启读事务，结束时提交；期间的多条查询不再各自隐式加锁"""
+    conn.execute("BEGIN")
+    try:
+        yield
+    finally:
+        conn.execute("COMMIT")
+
+def close_conn():
+    """关闭共用连接，关闭前执行 PRAGMA optimize 更新查询规划器所需的统计信息"""
+    global _conn
+    if _conn is not None:
+        try:
+            _conn.execute("PRAGMA optimize")
+        finally:
+            _conn.close()
+            _conn = None
+
+def format_preview(df, header=True):
+    """按列截断长文本并左对齐到15个字符，再按列拼接成行，不再逐个单元格格式化
+
+    df 应以 dtype=object 读取，数值保持数据库中的原样；header 为 True 时先输出列名行和分隔线
+    """
+    cells = []
+    for col in df.columns:
+        values = df[col].fillna('').astype(str)
+        # 处理长文本
+        values = values.where(values.str.len() <= 15, values.str.slice(0, 12) + "...")
+        cells.append(values.str.ljust(15))
+    lines = []
+    if header:
+        lines.append(" | ".join(f"{name:<15}" for name in df.columns))
+        lines.append(_SEP_120)
+    if cells:
+        lines.extend(cells[0].str.cat(cells[1:], sep=" | ").tolist())
+    return "\n".join(lines)
+
+def show_database_info(conn=None):
     db_path = get_db_path()
     
     # 检查数据库文件是否存在
@@ -13,140 +91,114 @@ def show_database_info():
         return
     
     # 连接数据库
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = conn or _open_conn()
     cursor = conn.cursor()
     
-    # 获取所有表名
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-    tables = cursor.fetchall()
+    # 所有查询在同一个读事务内执行，看到同一快照，只需获取一次共享锁
+    with _read_transaction(conn):
+        # 获取所有表名
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
+        tables = cursor.fetchall()
     
-    if not tables:
-        print("数据库中没有表")
-        conn.close()
-        return
+        if not tables:
+            print("数据库中没有表")
+            return
     
-    print(f"数据库路径: {db_path}")
-    print(f"数据库中有 {len(tables)} 个表\n")
+        print(f"数据库路径: {db_path}")
+        print(f"数据库中有 {len(tables)} 个表\n")
     
-    # 遍历每个表
-    for table_idx, table in enumerate(tables, 1):
-        table_name = table[0]
-        print(f"表 {table_idx}/{len(tables)}: {table_name}")
-        print("=" * 80)
-        
-        # 获取表结构
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = cursor.fetchall()
+        # 所有表的记录数用一条 UNION ALL 查询取出，不在循环里逐表执行 COUNT(*)
+        rowcounts = dict(cursor.execute(" UNION ALL ".join(
+            f"SELECT ?, COUNT(*) FROM {_quote_ident(table[0])}" for table in tables
+        ), [table[0] for table in tables]).fetchall())
+    
+        # 所有表的结构通过 pragma_table_info 表值函数一次查出，按表名分组
+        cols_by_table = {}
+        for col in cursor.execute("""
+            SELECT m.name AS tbl, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master m JOIN pragma_table_info(m.name) p
+            WHERE m.type='table'
+            ORDER BY m.name, p.cid
+        """):
+            cols_by_table.setdefault(col['tbl'], []).append(col)
+    
+        # 遍历每个表，每个表的输出先收集成行列表，最后一次写入标准输出
+        for table_idx, table in enumerate(tables, 1):
+            table_name = table[0]
+            out = [f"表 {table_idx}/{len(tables)}: {table_name}", _EQ_80]
         
-        print(f"表结构:")
-        print("-" * 80)
-        print(f"{'ID':<3} | {'列名':<20} | {'类型':<12} | {'可空':<4} | {'默认值':<15} | {'主键'}")
-        print("-" * 80)
+            # 获取表结构
+            columns = cols_by_table.get(table_name, [])
         
-        for col in columns:
-            print(f"{col['cid']:<3} | {col['name']:<20} | {col['type']:<12} | {'否' if col['notnull'] else '是':<4} | "
-                  f"{str(col['dflt_value'] or ''):<15} | {'是' if col['pk'] else '否'}")
+            out.append(f"表结构:")
+            out.extend(format_columns(columns))
         
-        # 获取记录数
-        cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-        count = cursor.fetchone()[0]
+            # 获取记录数
+            count = rowcounts.get(table_name, 0)
         
-        print(f"\n记录数: {count}")
+            out.append(f"\n记录数: {count}")
         
-        # 获取表内容（最多显示前10条）
-        if count > 0:
-            try:
-                cursor.execute(f"SELECT * FROM {table_name} LIMIT 10")
-                rows = cursor.fetchall()
-                
-                print("\n表内容预览(前10条):")
-                print("-" * 120)
+            # 获取表内容（最多显示前10条）
+            if count > 0:
+                try:
+                    df = pd.read_sql_query(f"SELECT * FROM {_quote_ident(table_name)} LIMIT 10", conn, dtype=object)
                 
-                # 列名
-                headers = [col['name'] for col in columns]
-                print(" | ".join(f"{header:<15}" for header in headers))
-                print("-" * 120)
+                    out.append("\n表内容预览(前10条):")
+                    out.append(_SEP_120)
+                    out.append(format_preview(df))
                 
-                # 数据行
-                for row in rows:
-                    row_data = []
-                    for header in headers:
-                        value = row[header]
-                        # 处理长文本
-                        if isinstance(value, str) and len(value) > 15:
-                            value = value[:12] + "..."
-                        row_data.append(f"{str(value or ''):<15}")
-                    print(" | ".join(row_data))
-                
-                if count > 10:
-                    print(f"\n... 只显示了前10条记录，共有{count}条记录")
-            except Exception as e:
-                print(f"无法获取表内容: {str(e)}")
+                    if count > 10:
+                        out.append(f"\n... 只显示了前10条记录，共有{count}条记录")
+                except Exception as e:
+                    out.append(f"无法获取表内容: {str(e)}")
         
-        print("\n" + "=" * 80 + "\n")
-    
-    conn.close()
+            out.append("\n" + _EQ_80 + "\n")
+            sys.stdout.write("\n".join(out) + "\n")
+    sys.stdout.flush()
 
-def show_specific_table(table_name):
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+def show_specific_table(table_name, conn=None):
+    conn = conn or _open_conn()
     cursor = conn.cursor()
     
-    # 检查表是否存在
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-    if not cursor.fetchone():
-        print(f"表 '{table_name}' 不存在")
-        conn.close()
-        return
+    # 记录数和表内容在同一个读事务内读取，两者对应同一快照
+    with _read_transaction(conn):
+        # 检查表是否存在；表名作为参数绑定，语句可被缓存复用，也不会被注入
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if not cursor.fetchone():
+            print(f"表 '{table_name}' 不存在")
+            return
+        table_ident = _quote_ident(table_name)
         
-    # 获取表结构
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
+        # 获取表结构
+        cursor.execute(f"PRAGMA table_info({table_ident})")
+        columns = cursor.fetchall()
     
-    print(f"表 '{table_name}' 结构:")
-    print("-" * 80)
-    print(f"{'ID':<3} | {'列名':<20} | {'类型':<12} | {'可空':<4} | {'默认值':<15} | {'主键'}")
-    print("-" * 80)
+        out = [f"表 '{table_name}' 结构:"]
+        out.extend(format_columns(columns))
     
-    for col in columns:
-        print(f"{col['cid']:<3} | {col['name']:<20} | {col['type']:<12} | {'否' if col['notnull'] else '是':<4} | "
-              f"{str(col['dflt_value'] or ''):<15} | {'是' if col['pk'] else '否'}")
+        # 记录数单独统计，表内容按批读取并逐批输出，不把整张表一次载入内存
+        count = cursor.execute(f"SELECT COUNT(*) FROM {table_ident}").fetchone()[0]
     
-    # 获取所有记录
-    cursor.execute(f"SELECT * FROM {table_name}")
-    rows = cursor.fetchall()
+        out.append(f"\n共有 {count} 条记录")
     
-    print(f"\n共有 {len(rows)} 条记录")
-    
-    if rows:
-        print("\n表内容:")
-        print("-" * 120)
-        
-        # 列名
-        headers = [col['name'] for col in columns]
-        print(" | ".join(f"{header:<15}" for header in headers))
-        print("-" * 120)
-        
-        # 数据行
-        for row in rows:
-            row_data = []
-            for header in headers:
-                value = row[header]
-                # 处理长文本
-                if isinstance(value, str) and len(value) > 15:
-                    value = value[:12] + "..."
-                row_data.append(f"{str(value or ''):<15}")
-            print(" | ".join(row_data))
+        if count:
+            out.append("\n表内容:")
+            out.append(_SEP_120)
+        sys.stdout.write("\n".join(out) + "\n")
     
-    conn.close()
+        if count:
+            chunks = pd.read_sql_query(f"SELECT * FROM {table_ident}", conn, chunksize=1000, dtype=object)
+            for i, chunk in enumerate(chunks):
+                sys.stdout.write(format_preview(chunk, header=(i == 0)) + "\n")
+    sys.stdout.flush()
 
 
 # 使用示例
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 1:
-        show_specific_table(sys.argv[1])
-    else:
-        show_database_info()
\ No newline at end of file
+    try:
+        if len(sys.argv) > 1:
+            show_specific_table(sys.argv[1])
+        else:
+            show_database_info()
+    finally:
+        close_conn()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from app import parse_backtest_params
+
+
+def make_request(**overrides):
+    data = {
+        "initial_capital": "100000",
+        "start_date": "2023-01-01",
+        "end_date": "2024-01-01",
+        "grid_levels": "10",
+        "grid_type": "volatility",
+    }
+    data.update(overrides)
+    return data
+
+
+def test_parse_backtest_params_valid():
+    params, error = parse_backtest_params(make_request(volatility="20", grid_range_upper="4.5"))
+    assert error is None
+    assert params["initial_capital"] == 100000.0
+    assert params["grid_levels"] == 10
+    assert params["grid_type"] == "volatility"
+    assert params["volatility"] == pytest.approx(0.2)
+    assert params["grid_spacing"] is None
+    assert params["grid_range_upper"] == 4.5
+    assert params["start_date"] == pd.Timestamp("2023-01-01")
+    assert params["end_date"] == pd.Timestamp("2024-01-01")
+
+
+@pytest.mark.parametrize("capital", ["abc", None, [1]])
+def test_parse_backtest_params_bad_capital(capital):
+    assert parse_backtest_params(make_request(initial_capital=capital)) == (None, "初始资金参数无效")
+
+
+@pytest.mark.parametrize("grid_levels", [2, 51, "-1", "100"])
+def test_parse_backtest_params_grid_levels_out_of_range(grid_levels):
+    assert parse_backtest_params(make_request(grid_levels=grid_levels)) == (None, "网格层数必须在3-50之间")
+
+
+@pytest.mark.parametrize("grid_levels", [3, 50])
+def test_parse_backtest_params_grid_levels_bounds(grid_levels):
+    params, error = parse_backtest_params(make_request(grid_levels=grid_levels))
+    assert error is None
+    assert params["grid_levels"] == grid_levels
+
+
+def test_parse_backtest_params_bad_grid_levels():
+    assert parse_backtest_params(make_request(grid_levels="ten")) == (None, "网格层数参数无效")
+
+
+def test_parse_backtest_params_unknown_grid_type():
+    assert parse_backtest_params(make_request(grid_type="fibonacci")) == (None, "无效的网格类型")
+
+
+@pytest.mark.parametrize("start_date, end_date", [("2024-01-01", "2024-01-01"), ("2024-06-01", "2024-01-01")])
+def test_parse_backtest_params_start_not_before_end(start_date, end_date):
+    result = parse_backtest_params(make_request(start_date=start_date, end_date=end_date))
+    assert result == (None, "开始日期必须早于结束日期")
+
+
+def test_parse_backtest_params_missing_dates():
+    assert parse_backtest_params(make_request(end_date="")) == (None, "未提供回测日期范围")
+
+
+def test_parse_backtest_params_bad_date():
+    assert parse_backtest_params(make_request(start_date="not-a-date")) == (None, "日期格式无效")
+
+
+def test_parse_backtest_params_bad_optional_param():
+    assert parse_backtest_params(make_request(grid_spacing="wide")) == (None, "自定义网格间隔参数无效")
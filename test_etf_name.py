@@ -1,20 +1,24 @@
 from unittest.mock import patch
 
 import pandas as pd
+import pytest
 
 from models.etf_data import get_etf_data
 
 
-def test_get_etf_data_fallback():
-    sample = pd.DataFrame(
+@pytest.fixture(scope="module")
+def sample_df():
+    return pd.DataFrame(
         {
             "Date": pd.date_range("2024-01-01", periods=3),
             "Close": [1.0, 2.0, 3.0],
         }
     ).set_index("Date")
 
+
+def test_get_etf_data_fallback(sample_df):
     with patch("models.etf_data.ak.fund_etf_hist_em", side_effect=Exception("403")):
-        with patch("models.etf_data.yf.download", return_value=sample):
+        with patch("models.etf_data.yf.download", return_value=sample_df):
             df, symbol = get_etf_data("510300")
             assert symbol == "510300"
             assert list(df.columns) == ["close"]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import calculate_volatility
+from models import etf_data
+
+
+@pytest.fixture(scope="module")
+def prices():
+    rng = np.random.default_rng(0)
+    values = 3.0 + np.cumsum(rng.normal(0, 0.02, 1000))
+    # 连续缺失和单个缺失各一段
+    values[100:105] = np.nan
+    values[600] = np.nan
+    return values
+
+
+def expected_rolling(values, window, method):
+    return getattr(pd.Series(values).rolling(window), method)().to_numpy()
+
+
+@pytest.mark.parametrize("rolling_std", [etf_data._rolling_std, calculate_volatility._rolling_std])
+@pytest.mark.parametrize("window", [2, 20, 200, 999, 1000, 1001])
+def test_rolling_std_matches_pandas(prices, rolling_std, window):
+    returns = np.diff(prices) / prices[:-1]
+    np.testing.assert_allclose(
+        rolling_std(returns, window), expected_rolling(returns, window, "std"), rtol=1e-8, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("rolling_std", [etf_data._rolling_std, calculate_volatility._rolling_std])
+def test_rolling_std_all_nan(rolling_std):
+    values = np.full(10, np.nan)
+    assert np.isnan(rolling_std(values, 3)).all()
+
+
+@pytest.mark.parametrize(
+    "short_window, long_window",
+    [(200, 800), (100, 500), (30, 70), (50, 49), (20, 1500), (1500, 2000)],
+)
+def test_etf_data_rolling_max_min_matches_pandas(prices, short_window, long_window):
+    high_short, low_short, high_long, low_long = etf_data._rolling_max_min(prices, short_window, long_window)
+    np.testing.assert_array_equal(high_short, expected_rolling(prices, short_window, "max"))
+    np.testing.assert_array_equal(low_short, expected_rolling(prices, short_window, "min"))
+    np.testing.assert_array_equal(high_long, expected_rolling(prices, long_window, "max"))
+    np.testing.assert_array_equal(low_long, expected_rolling(prices, long_window, "min"))
+
+
+@pytest.mark.parametrize("window", [1, 200, 1000, 1001])
+def test_calculate_volatility_rolling_max_min_matches_pandas(prices, window):
+    high, low = calculate_volatility._rolling_max_min(prices, window)
+    np.testing.assert_array_equal(high, expected_rolling(prices, window, "max"))
+    np.testing.assert_array_equal(low, expected_rolling(prices, window, "min"))